@@ -0,0 +1,147 @@
+"""Header-only admission checks for uploaded images, run before any pixel is decoded.
+
+The format is sniffed from the magic bytes (the filename extension is ignored),
+then Pillow's lazy open reads just the header to get the dimensions. Uploads
+that are too large, not JPEG/PNG/GIF/WebP, larger than the pixel limits, far smaller
+than their decoded size (decompression bombs) or GIFs with many frames are
+rejected with an ``AdmissionError`` carrying a machine-readable reason.
+"""
+import io
+import os
+import warnings
+
+from PIL import Image, features
+
+import metrics
+
+MAX_IMAGE_BYTES = int(float(os.environ.get("MAX_IMAGE_MB", 20)) * 2**20)
+MAX_IMAGE_PIXELS = int(os.environ.get("MAX_IMAGE_PIXELS", 50_000_000))
+MAX_IMAGE_SIDE = int(os.environ.get("MAX_IMAGE_SIDE", 16384))
+# Decoded RGB bytes per uploaded byte; real scans and photos stay far below this. 0 disables
+MAX_COMPRESSION_RATIO = float(os.environ.get("MAX_COMPRESSION_RATIO", 500))
+# Below this many pixels decoding is cheap whatever the ratio (flat or synthetic images compress well)
+BOMB_MIN_PIXELS = 4_000_000
+# Only the first frame is classified, so long animations are decode cost for nothing
+MAX_GIF_FRAMES = int(os.environ.get("MAX_GIF_FRAMES", 16))
+
+SIGNATURES = (
+    (b"\xff\xd8\xff", "JPEG"),
+    (b"\x89PNG\r\n\x1a\n", "PNG"),
+    (b"GIF87a", "GIF"),
+    (b"GIF89a", "GIF"),
+)
+# WebP (what the web UI re-encodes to) only when Pillow was built with it
+WEBP = features.check("webp")
+
+REJECTIONS = metrics.counter("upload_rejections_total", "Uploads rejected before decoding", ["reason"])
+REJECTED_BYTES = metrics.counter("upload_rejected_bytes_total", "Bytes of uploads rejected before decoding",
+                                 ["reason"])
+
+# The pixel limits above replace Pillow's own warning threshold
+warnings.filterwarnings('ignore', category=Image.DecompressionBombWarning)
+
+
+class AdmissionError(ValueError):
+    """An upload refused by ``check_image``; ``to_dict()`` is the JSON error body"""
+
+    def __init__(self, reason, message, status=400, **details):
+        super().__init__(message)
+        self.reason = reason
+        self.status = status
+        self.details = details
+
+    def to_dict(self):
+        return {"error": str(self), "reason": self.reason, **self.details}
+
+
+def reject(reason, message, nbytes, status=400, **details):
+    """Count a rejection of ``nbytes`` and build the error to raise"""
+    REJECTIONS.inc(reason=reason)
+    REJECTED_BYTES.inc(nbytes, reason=reason)
+    return AdmissionError(reason, message, status, **details)
+
+
+def sniff(head):
+    """Image format named by the leading magic bytes, or None"""
+    if WEBP and head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "WEBP"
+    for signature, fmt in SIGNATURES:
+        if head.startswith(signature):
+            return fmt
+    return None
+
+
+def _sub_blocks(view, pos):
+    """Position after a chain of GIF data sub-blocks starting at ``pos``"""
+    while pos < len(view) and view[pos]:
+        pos += view[pos] + 1
+    return pos + 1
+
+
+def gif_frames(view, limit):
+    """Number of image descriptors in a GIF, counting at most ``limit``; no LZW data is decoded"""
+    if len(view) < 13:
+        return 0
+    pos = 13
+    if view[10] & 0x80:
+        pos += 3 << ((view[10] & 0x07) + 1)
+    frames = 0
+    while pos < len(view) and frames < limit:
+        block = view[pos]
+        if block == 0x2C:
+            frames += 1
+            packed = view[pos + 9] if pos + 9 < len(view) else 0
+            pos += 10
+            if packed & 0x80:
+                pos += 3 << ((packed & 0x07) + 1)
+            pos = _sub_blocks(view, pos + 1)
+        elif block == 0x21:
+            pos = _sub_blocks(view, pos + 2)
+        else:
+            break
+    return frames
+
+
+def check_image(data):
+    """Admit an upload (bytes or in-memory stream) or raise ``AdmissionError``.
+
+    Returns {"format", "width", "height", "frames", "bytes"} read from the header alone.
+    """
+    # Nothing is copied: a stream is read in place and rewound, a BytesIO over bytes shares them
+    if hasattr(data, 'getbuffer'):
+        stream, view = data, data.getbuffer()
+    else:
+        stream, view = io.BytesIO(data), memoryview(data)
+    with view:
+        nbytes = view.nbytes
+        if nbytes == 0:
+            raise reject("empty", "Empty upload", 0)
+        if nbytes > MAX_IMAGE_BYTES:
+            raise reject("too_large", f"Image is {nbytes} bytes (max {MAX_IMAGE_BYTES})", nbytes, 413,
+                         limit=MAX_IMAGE_BYTES)
+        fmt = sniff(bytes(view[:12]))
+        if fmt is None:
+            raise reject("unsupported_format", "Not a JPEG, PNG, GIF or WebP image", nbytes, 415)
+        try:
+            stream.seek(0)
+            with Image.open(stream, formats=[fmt]) as img:
+                width, height = img.size
+        except Image.DecompressionBombError as e:
+            raise reject("decompression_bomb", str(e), nbytes, 422) from None
+        except Exception:
+            raise reject("malformed", f"Unreadable {fmt} header", nbytes, 400, format=fmt) from None
+        finally:
+            stream.seek(0)
+        frames = gif_frames(view, MAX_GIF_FRAMES + 1) if fmt == "GIF" else 1
+    pixels = width * height
+    size = {"format": fmt, "width": width, "height": height}
+    if max(width, height) > MAX_IMAGE_SIDE or pixels > MAX_IMAGE_PIXELS:
+        raise reject("too_many_pixels", f"Image is {width}x{height} (max {MAX_IMAGE_PIXELS} pixels, "
+                     f"{MAX_IMAGE_SIDE} per side)", nbytes, 422, **size)
+    if MAX_COMPRESSION_RATIO and pixels > BOMB_MIN_PIXELS and pixels * 3 > MAX_COMPRESSION_RATIO * nbytes:
+        raise reject("decompression_bomb", f"{nbytes} bytes would decode to {width}x{height} pixels",
+                     nbytes, 422, **size)
+    if frames > MAX_GIF_FRAMES:
+        raise reject("too_many_frames", f"Animated GIF has more than {MAX_GIF_FRAMES} frames", nbytes, 422,
+                     **size)
+    return dict(size, frames=frames, bytes=nbytes)
@@ -1,247 +1,1054 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Request, Response, g, request, jsonify, send_file
+from werkzeug.exceptions import RequestEntityTooLarge
+import base64
+import contextlib
+import copy
+import hmac
+import io
+import json
 import os
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+import zlib
 import torch
-from predict import build_model, load_checkpoint, predict_image
+from torch.profiler import record_function
+from predict import (CLASS_NAMES, BF16_AUTOCAST, CHANNELS_LAST, build_model, feature_head, grad_cam_model,
+                     load_checkpoint, load_image, predict_batch, predict_image, predict_images, predict_tta,
+                     prepare_model, verify_execution_mode)
+from backends import EagerBackend, load_backend
+from batcher import MicroBatcher
+from cascade import Cascade
+from jobs import JobQueue
+from registry import ModelRegistry
+from quantize import quantize_model
+from cache import create_cache, fingerprint_file, hash_bytes
+from embeddings import EmbeddingStore
+from preprocess import heatmap_overlay
+import frontend
+from admission import MAX_IMAGE_BYTES, WEBP, AdmissionError, check_image, reject
+import metrics
+from metrics import STAGE_SECONDS
+from profiling import PROFILE_HEADER, PROFILE_TOKEN, RequestProfiler
+from volumes import VOLUME_BATCH_SIZE, VOLUME_EXTENSIONS, open_volume, score_volume
 
-app = Flask(__name__)
+class InMemoryRequest(Request):
+    """Keep multipart uploads in memory instead of spooling large ones to a temp file.
 
-# Configuration
-MODEL_PATH = "C:/Users/ASUS/Desktop/407_Ferdows/Web site/best_resnext50_model.pth"
-UPLOAD_FOLDER = 'uploads'
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+    Studies are the exception: they can be far larger than an image and are read a slice at a time.
+    """
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.path == "/predict/study":
+            return tempfile.TemporaryFile()
+        return io.BytesIO()
+
+# The web UI is served from frontend.py, precompressed, instead of Flask's static view
+app = Flask(__name__, static_folder=None)
+app.request_class = InMemoryRequest
 
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+# Configuration
+MODEL_PATH = os.environ.get("MODEL_PATH", "C:/Users/ASUS/Desktop/407_Ferdows/Web site/best_resnext50_model.pth")
+# Name/version MODEL_PATH is registered under; more versions can be added from a JSON file
+# {"<name>": {"versions": {"<version>": {"path": ..., "arch": ...}}, "traffic": {"<version>": weight}}}
+# or at runtime through /admin/models
+MODEL_NAME = os.environ.get("MODEL_NAME", "resnext50")
+MODEL_VERSION = os.environ.get("MODEL_VERSION", "1")
+MODEL_REGISTRY = os.environ.get("MODEL_REGISTRY", "")
+# Versions receiving no traffic are unloaded least-recently-used first above this; 0 = no limit
+MODEL_MEMORY_BUDGET_MB = float(os.environ.get("MODEL_MEMORY_BUDGET_MB", 0))
+# Required by every /admin route; unset disables them
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+# Whole request bodies above this are refused before they are read; per-image limits are in admission.py
+MAX_REQUEST_BYTES = int(float(os.environ.get("MAX_REQUEST_MB", 256)) * 2**20)
+app.config["MAX_CONTENT_LENGTH"] = MAX_REQUEST_BYTES
+# Single-image routes are capped at one admissible image plus the multipart framing and form fields
+SINGLE_IMAGE_ROUTES = ("/predict", "/search")
+MULTIPART_OVERHEAD_BYTES = int(os.environ.get("MULTIPART_OVERHEAD_BYTES", 64 * 1024))
+# The web UI downscales images in the browser to this longest side and re-encodes them at
+# UPLOAD_QUALITY (WebP, else JPEG) before uploading; the server still resizes to 224x224. 0 = off
+UPLOAD_MAX_SIDE = int(os.environ.get("UPLOAD_MAX_SIDE", 448))
+UPLOAD_QUALITY = float(os.environ.get("UPLOAD_QUALITY", 0.9))
+# Inference backend: "eager", "torchscript", "compile" or "onnx" (checked against eager on load)
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "eager")
+BACKEND_PARITY_ATOL = float(os.environ.get("BACKEND_PARITY_ATOL", 1e-3))
+# INT8 CPU serving: "none", "static" (calibrated on QUANTIZATION_CALIBRATION_DIR) or "dynamic"
+QUANTIZATION = os.environ.get("QUANTIZATION", "none")
+QUANTIZATION_CALIBRATION_DIR = os.environ.get("QUANTIZATION_CALIBRATION_DIR")
+# Micro-batching: concurrent /predict calls are coalesced into one forward pass
+MAX_BATCH_SIZE = int(os.environ.get("MAX_BATCH_SIZE", 16))
+MAX_BATCH_WAIT_MS = float(os.environ.get("MAX_BATCH_WAIT_MS", 10))
+# /predict/batch: images per request and images per forward pass
+MAX_BATCH_FILES = int(os.environ.get("MAX_BATCH_FILES", 256))
+# Uncompressed bytes that the zip archives of one request may inflate to, in total
+MAX_BATCH_INFLATED_BYTES = int(float(os.environ.get("MAX_BATCH_INFLATED_MB", 1024)) * 2**20)
+PREDICT_CHUNK_SIZE = int(os.environ.get("PREDICT_CHUNK_SIZE", 32))
+# Prediction cache keyed by image bytes + checkpoint fingerprint: "memory", "disk" or "none"
+CACHE_BACKEND = os.environ.get("CACHE_BACKEND", "memory")
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", 10000))
+CACHE_TTL_SECONDS = float(os.environ.get("CACHE_TTL_SECONDS", 3600))
+CACHE_DIR = os.environ.get("CACHE_DIR", "cache")
+# Optional screening model in front of ResNeXt50: it answers when its confidence reaches
+# CASCADE_THRESHOLD and its class is not in CASCADE_ESCALATE_CLASSES; otherwise ResNeXt50 does
+CASCADE_MODEL_PATH = os.environ.get("CASCADE_MODEL_PATH", "")
+CASCADE_ARCH = os.environ.get("CASCADE_ARCH", "resnet18")
+CASCADE_THRESHOLD = float(os.environ.get("CASCADE_THRESHOLD", 0.95))
+CASCADE_ESCALATE_CLASSES = [c.strip() for c in os.environ.get("CASCADE_ESCALATE_CLASSES", "no_tumor").split(",")
+                            if c.strip()]
+# Test-time augmentation (/predict?tta=1) is skipped when the plain confidence reaches this
+TTA_CONFIDENCE_THRESHOLD = float(os.environ.get("TTA_CONFIDENCE_THRESHOLD", 0.9))
+# Penultimate-layer embeddings of every /predict forward are appended here (one store per
+# model fingerprint) and searched by /search; empty disables recording
+EMBEDDING_STORE_DIR = os.environ.get("EMBEDDING_STORE_DIR", "")
+# Asynchronous jobs (/jobs): worker threads, images per batched forward (across jobs), finished
+# jobs kept for JOB_TTL_SECONDS up to JOB_MAX_JOBS, and at most JOB_MAX_QUEUED_IMAGES waiting
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 1))
+JOB_MAX_JOBS = int(os.environ.get("JOB_MAX_JOBS", 1000))
+JOB_TTL_SECONDS = float(os.environ.get("JOB_TTL_SECONDS", 3600))
+JOB_MAX_QUEUED_IMAGES = int(os.environ.get("JOB_MAX_QUEUED_IMAGES", 10000))
+# Job event logs shared by several server processes (serve.py uses a temporary one when unset)
+JOB_DIR = os.environ.get("JOB_DIR", "")
+# Seconds between SSE keep-alive comments while a job has nothing new
+JOB_HEARTBEAT_SECONDS = float(os.environ.get("JOB_HEARTBEAT_SECONDS", 15))
+# Warm-up forwards run before the app reports ready, e.g. "1,4,16"
+WARMUP_BATCH_SIZES = [int(n) for n in os.environ.get(
+    "WARMUP_BATCH_SIZES", f"1,{max(1, MAX_BATCH_SIZE // 4)},{MAX_BATCH_SIZE}").split(",") if n.strip()]
 
 # Global variable for model
 model = None
+backend = None
+batcher = None
+cascade = None
+cascade_fingerprint = ""
+cache = None
+registry = None
+embedding_stores = {}
+ready = False
+STARTUP_TIMINGS = {}
+# Set by serve.py: server processes sharing the port, and the intra-op thread budget of each
+# for backends with their own pool (ONNX Runtime); 0 lets the backend use every core
+worker_count = 1
+backend_threads = 0
+profiler = RequestProfiler()
+assets = frontend.build()
+
+@contextlib.contextmanager
+def startup_phase(name, timings=STARTUP_TIMINGS):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = round((time.perf_counter() - started) * 1000.0, 1)
+
+def warmup(batch_sizes=None, target=None):
+    """Run throwaway forwards so the first real requests don't pay allocation/compilation costs"""
+    for n in sorted(set(batch_sizes or WARMUP_BATCH_SIZES)):
+        predict_batch(torch.zeros(n, 3, 224, 224), target or backend)
+
+def load_version(path, arch="resnext50_32x4d", timings=STARTUP_TIMINGS):
+    """Build, load, convert and warm up one checkpoint; returns (model, backend)"""
+    with startup_phase("build", timings):
+        model = build_model(empty=True, arch=arch)
+    with startup_phase("load_weights", timings):
+        model = load_checkpoint(model, path)
+        model.eval()
+    if CHANNELS_LAST or BF16_AUTOCAST:
+        with startup_phase("execution_mode", timings):
+            reference = copy.deepcopy(model)
+            model = prepare_model(model)
+            diff = verify_execution_mode(model, reference)
+            del reference
+        print(f"Execution mode channels_last={CHANNELS_LAST} bf16={BF16_AUTOCAST} "
+              f"verified against FP32: max |logit diff| = {diff:.2e}")
+    with startup_phase("backend", timings):
+        if QUANTIZATION != "none":
+            # Quantized kernels run on CPU in eager mode only
+            version_backend = EagerBackend(quantize_model(model, QUANTIZATION, QUANTIZATION_CALIBRATION_DIR))
+            print(f"Serving {QUANTIZATION} INT8 model")
+        else:
+            try:
+                version_backend = load_backend(INFERENCE_BACKEND, model, path, BACKEND_PARITY_ATOL, backend_threads)
+            except Exception as e:
+                print(f"Falling back to eager backend: {e}")
+                version_backend = EagerBackend(model)
+    with startup_phase("warmup", timings):
+        warmup(target=version_backend)
+    return model, version_backend
+
+def model_fingerprint(path):
+    # INT8 and BF16 results differ slightly from FP32, so they get their own cache entries
+    fingerprint = fingerprint_file(path)
+    if QUANTIZATION != "none":
+        fingerprint += f"-int8-{QUANTIZATION}"
+    elif BF16_AUTOCAST:
+        fingerprint += "-bf16"
+    return fingerprint
+
+def load_registry_version(mv):
+    model, version_backend = load_version(mv.path, mv.arch, mv.timings)
+    return (model, version_backend, MicroBatcher(version_backend, MAX_BATCH_SIZE, MAX_BATCH_WAIT_MS),
+            model_fingerprint(mv.path))
+
+def activate_version(name, mv):
+    """Point the default globals (and the cascade's full stage) at the primary version of MODEL_NAME"""
+    global model, backend, batcher
+    if name != MODEL_NAME or mv is None:
+        return
+    model, backend, batcher = mv.model, mv.backend, mv.batcher
+    if cascade is not None:
+        cascade.full = batcher
+    if cache is not None:
+        cache.model_fingerprint = mv.fingerprint + cascade_fingerprint
+    print(f"Serving {name}:{mv.version} from {mv.path}")
+
+def load_registry_config(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    for name, entry in config.items():
+        for version, spec in entry.get("versions", {}).items():
+            registry.register(name, str(version), spec["path"], spec.get("arch", "resnext50_32x4d"))
+        traffic = {str(v): w for v, w in entry.get("traffic", {}).items()}
+        # Each loaded version joins the split right away, so loading the next cannot evict it
+        loaded = {}
+        for version, weight in traffic.items():
+            registry.load(name, version)
+            loaded[version] = weight
+            registry.set_traffic(name, loaded)
 
 def load_model():
     """Load the model once at startup"""
-    global model
+    global model, backend, batcher, cascade, cascade_fingerprint, cache, registry, ready
+    ready = False
+    STARTUP_TIMINGS.clear()
+    started = time.perf_counter()
     try:
-        model = build_model()
-        model = load_checkpoint(model, MODEL_PATH)
-        model.eval()
+        model, backend = load_version(MODEL_PATH)
+        batcher = MicroBatcher(backend, MAX_BATCH_SIZE, MAX_BATCH_WAIT_MS)
+        if CASCADE_MODEL_PATH:
+            with startup_phase("cascade"):
+                screen_model = load_checkpoint(build_model(empty=True, arch=CASCADE_ARCH), CASCADE_MODEL_PATH)
+                screen_backend = EagerBackend(prepare_model(screen_model))
+                warmup(target=screen_backend)
+                cascade = Cascade(MicroBatcher(screen_backend, MAX_BATCH_SIZE, MAX_BATCH_WAIT_MS), batcher,
+                                  CASCADE_THRESHOLD, CASCADE_ESCALATE_CLASSES)
+                cascade_fingerprint = (f"-cascade-{fingerprint_file(CASCADE_MODEL_PATH)}-{CASCADE_THRESHOLD:g}-"
+                                       + "+".join(sorted(CASCADE_ESCALATE_CLASSES)))
+            print(f"Cascade enabled: {CASCADE_ARCH} screening, threshold {CASCADE_THRESHOLD}, "
+                  f"always escalating {CASCADE_ESCALATE_CLASSES}")
+        with startup_phase("cache"):
+            fingerprint = model_fingerprint(MODEL_PATH)
+            cache = create_cache(CACHE_BACKEND, fingerprint + cascade_fingerprint,
+                                 CACHE_MAX_ENTRIES, CACHE_TTL_SECONDS, CACHE_DIR)
+        registry = ModelRegistry(load_registry_version, int(MODEL_MEMORY_BUDGET_MB * 2**20), activate_version)
+        registry.add_loaded(MODEL_NAME, MODEL_VERSION, MODEL_PATH, model, backend, batcher, fingerprint)
+        registry.set_traffic(MODEL_NAME, {MODEL_VERSION: 1.0})
+        if MODEL_REGISTRY:
+            with startup_phase("registry"):
+                load_registry_config(MODEL_REGISTRY)
+        STARTUP_TIMINGS["total"] = round((time.perf_counter() - started) * 1000.0, 1)
+        ready = True
         print("Model loaded successfully")
+        print("Startup timings (ms): " + ", ".join(f"{k}={v}" for k, v in STARTUP_TIMINGS.items()))
     except Exception as e:
         print(f"Error loading model: {e}")
         model = None
+        backend = None
+        batcher = None
+        cascade = None
+        cache = None
+        registry = None
+
+def load_model_async():
+    """Load in the background so the server can answer /ready with 503 meanwhile"""
+    thread = threading.Thread(target=load_model, name="model-loader", daemon=True)
+    thread.start()
+    return thread
+
+def is_zip(filename):
+    return filename.lower().endswith('.zip')
+
+def read_topk():
+    try:
+        topk = int(request.values.get("topk", 1))
+    except ValueError:
+        topk = 1
+    return min(max(topk, 1), len(CLASS_NAMES))
+
+def admit(filename, image):
+    """(filename, image) when the upload passes admission, else (filename, AdmissionError)"""
+    try:
+        check_image(image)
+    except AdmissionError as e:
+        return filename, e
+    return filename, image
+
+def collect_batch_items(files):
+    """Expand uploaded files and zip archives into (filename, file object or error) pairs.
+
+    Errors are strings for unreadable archives and ``AdmissionError`` for rejected images. The
+    whole request is refused with an ``AdmissionError`` past MAX_BATCH_FILES images or
+    MAX_BATCH_INFLATED_BYTES of zip members, decided from the zip directory before inflating.
+    """
+    items = []
+    inflated = 0
+
+    def check_room():
+        if len(items) >= MAX_BATCH_FILES:
+            raise reject("too_many_images", f"Too many images (max {MAX_BATCH_FILES})", 0, 400,
+                         limit=MAX_BATCH_FILES)
+
+    for file in files:
+        check_room()
+        if is_zip(file.filename):
+            try:
+                archive = zipfile.ZipFile(file.stream)
+            except zipfile.BadZipFile:
+                items.append((file.filename, "Invalid zip archive"))
+                continue
+            with archive:
+                for info in archive.infolist():
+                    if info.is_dir() or os.path.basename(info.filename).startswith('.'):
+                        continue
+                    check_room()
+                    if info.file_size > MAX_IMAGE_BYTES:
+                        # Refused from the directory entry, without inflating the member
+                        items.append((info.filename, reject(
+                            "too_large", f"Image is {info.file_size} bytes (max {MAX_IMAGE_BYTES})",
+                            info.compress_size, 413, limit=MAX_IMAGE_BYTES)))
+                        continue
+                    # A member never inflates past its declared size, so this bounds the memory used
+                    inflated += info.file_size
+                    if inflated > MAX_BATCH_INFLATED_BYTES:
+                        raise reject("batch_too_large", "Zip archives inflate to more than "
+                                     f"{MAX_BATCH_INFLATED_BYTES} bytes", 0, 413, limit=MAX_BATCH_INFLATED_BYTES)
+                    try:
+                        data = archive.read(info)
+                    except (zipfile.BadZipFile, zlib.error, NotImplementedError, EOFError):
+                        items.append((info.filename, "Unreadable zip member"))
+                        continue
+                    items.append(admit(info.filename, data))
+        else:
+            items.append(admit(file.filename, file.stream))
+    return items
+
+def cached_lookup(data, fingerprint=None):
+    """Return (cache key, cached results or None, "hit"/"miss"/"off", cascade stage) for raw image data"""
+    if cache is None:
+        return None, None, "off", None
+    with STAGE_SECONDS.time(stage="cache_lookup"):
+        key = cache.key(data, fingerprint)
+        results, stage = cache.get_entry(key)
+    return key, results, "miss" if results is None else "hit", stage
+
+def tta_lookup(key, image, plain, model_backend):
+    """TTA result for ``image`` given its plain results (None: computed on ``model_backend``),
+    cached next to the plain entry"""
+    tta_key = None if key is None else f"{key}-tta{TTA_CONFIDENCE_THRESHOLD:g}"
+    tta = cache.get_value(tta_key, count=False) if tta_key is not None else None
+    if tta is None:
+        tta = predict_tta(image, model_backend, TTA_CONFIDENCE_THRESHOLD, plain=plain)
+        if tta_key is not None:
+            cache.put_value(tta_key, tta)
+    return tta
+
+@contextlib.contextmanager
+def model_version(name=None, version=None):
+    """Model version pinned by ``name``/``version``, else picked by the traffic split.
+
+    Yields (version or None, backend, batcher, use cascade, cache fingerprint); the
+    cascade only fronts the primary version of the default model.
+    """
+    if registry is None:
+        yield None, backend, batcher, cascade is not None, None
+        return
+    with registry.acquire(name, version) as mv:
+        primary = mv.batcher is batcher
+        fingerprint = mv.fingerprint + (cascade_fingerprint if primary else "")
+        yield mv, mv.backend, mv.batcher, primary and cascade is not None, fingerprint
+
+def serving_version():
+    """``model_version`` for this request's ``model``/``version`` values"""
+    return model_version(request.values.get("model"), request.values.get("version"))
+
+def supports_embeddings(model_backend):
+    try:
+        feature_head(model_backend)
+        return True
+    except ValueError:
+        return False
+
+def supports_explanations(model_backend):
+    try:
+        grad_cam_model(model_backend)
+        return True
+    except ValueError:
+        return False
+
+def embedding_store(mv, dim=None):
+    """The store for the serving version's weights, or None when recording is off.
+
+    A store that does not exist yet is created once ``dim`` is known.
+    """
+    if not EMBEDDING_STORE_DIR:
+        return None
+    if mv is not None:
+        fingerprint = mv.fingerprint
+    else:
+        fingerprint = cache.model_fingerprint if cache is not None else "default"
+    store = embedding_stores.get(fingerprint)
+    if store is None:
+        path = os.path.join(EMBEDDING_STORE_DIR, fingerprint)
+        if dim is None:
+            try:
+                with open(os.path.join(path, "store.json"), 'r', encoding='utf-8') as f:
+                    dim = json.load(f)["dim"]
+            except (OSError, ValueError, KeyError):
+                return None
+        store = embedding_stores.setdefault(fingerprint, EmbeddingStore(path, dim))
+    return store
 
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+def admin_token_ok():
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(request.headers.get("X-Admin-Token", ""), ADMIN_TOKEN)
+
+def admin_denied():
+    if not ADMIN_TOKEN:
+        return jsonify({"error": "Admin routes are disabled: ADMIN_TOKEN is not set"}), 403
+    return jsonify({"error": "Invalid admin token"}), 403
+
+def profile_token_ok(value):
+    return bool(PROFILE_TOKEN) and hmac.compare_digest(value or "", PROFILE_TOKEN)
+
+def profile_denied():
+    if not PROFILE_TOKEN:
+        return jsonify({"error": "Profiling is disabled: PROFILE_TOKEN is not set"}), 403
+    return jsonify({"error": "Invalid profiling token"}), 403
+
+def profile_requested():
+    value = request.headers.get(PROFILE_HEADER)
+    return value is not None and profile_token_ok(value)
+
+def error_entry(filename, error):
+    """Result entry for an image that was not classified (admission rejection or message)"""
+    details = error.to_dict() if isinstance(error, AdmissionError) else {"error": error}
+    return {"filename": filename, **details, "status": "error"}
+
+def classify_items(items, topk, run_backend, use_cascade, fingerprint):
+    """Result entries for (filename, image or error) pairs: cache hits first, the rest in batched forwards"""
+    entries = [error_entry(name, image) for name, image in items]
+    misses = []
+    for i, (name, image) in enumerate(items):
+        if isinstance(image, (str, AdmissionError)):
+            continue
+        key, results, cache_status, stage = cached_lookup(image, fingerprint)
+        if results is None:
+            misses.append((i, key, cache_status, image))
+        else:
+            entries[i] = {"filename": name, **format_results(results[:topk]),
+                          "cache": cache_status, "status": "success"}
+            if stage is not None:
+                entries[i]["stage"] = stage
+
+    images = [image for _, _, _, image in misses]
+    if use_cascade:
+        predictions, stages = cascade.predict_images(images, topk=len(CLASS_NAMES), batch_size=PREDICT_CHUNK_SIZE)
+    else:
+        predictions = predict_images(images, run_backend, topk=len(CLASS_NAMES), batch_size=PREDICT_CHUNK_SIZE)
+        stages = [None] * len(images)
+
+    for (i, key, cache_status, _), (results, error), stage in zip(misses, predictions, stages):
+        if error is not None:
+            entries[i]["error"] = f"Prediction failed: {error}"
+            continue
+        if key is not None:
+            cache.put(key, results, stage)
+        entries[i] = {"filename": items[i][0], **format_results(results[:topk]),
+                      "cache": cache_status, "status": "success"}
+        if stage is not None:
+            entries[i]["stage"] = stage
+    return entries
+
+def predict_upload(data, filename, mv, run_backend, run_batcher, use_cascade, fingerprint,
+                   want_embedding=False, want_heatmap=False):
+    """Classify one admitted upload (bytes or in-memory stream) on a version from ``model_version``.
+
+    The /predict path shared by every front end: cache, cascade or micro-batcher, and embedding
+    recording. Returns a dict of "results", "cache", "stage", "key", "input_batch" (None when
+    nothing was decoded), "embedding" and "explanation".
+    """
+    embedding = explanation = None
+    record = bool(EMBEDDING_STORE_DIR) and (want_embedding or supports_embeddings(run_backend))
+    key, results, cache_status, stage = cached_lookup(data, fingerprint)
+    image_hash = key.split("-", 1)[0] if key is not None else None
+    if image_hash is None and record:
+        image_hash = hash_bytes(data)
+    heatmap_key = f"{key}-heatmap" if key is not None else None
+    if want_heatmap and heatmap_key is not None:
+        explanation = cache.get_value(heatmap_key, count=False)
+    # Embeddings and heatmaps come out of the same batched forward as the prediction
+    extras = []
+    if want_embedding or (record and results is None):
+        extras.append("embedding")
+    if want_heatmap and explanation is None:
+        extras.append("heatmap")
+    input_batch = None
+    if results is None or extras:
+        # Decode straight from the in-memory upload; nothing is written to disk.
+        # All classes are kept so one cache entry serves any top-k.
+        input_batch = load_image(data)
+        if use_cascade and results is None and not (want_embedding or want_heatmap):
+            # Images answered by the screening model have no ResNeXt50 embedding
+            results, stage = cascade.predict(input_batch, topk=len(CLASS_NAMES))
+        else:
+            if extras:
+                fresh, outputs = run_batcher.predict(input_batch, topk=len(CLASS_NAMES), extras=extras)
+            else:
+                fresh, outputs = run_batcher.predict(input_batch, topk=len(CLASS_NAMES)), {}
+            embedding = outputs.get("embedding")
+            if "heatmap" in outputs:
+                explanation = {"class": fresh[0][0],
+                               "heatmap": [[round(float(v), 3) for v in row] for row in outputs["heatmap"]]}
+                if heatmap_key is not None:
+                    cache.put_value(heatmap_key, explanation)
+            if results is None:
+                results = fresh
+                # Behind the cascade this is the full model's answer
+                stage = "full" if use_cascade else None
+        if key is not None and cache_status == "miss":
+            cache.put(key, results, stage)
+    if record and embedding is not None:
+        embedding_store(mv, len(embedding)).add(image_hash, embedding, {
+            "filename": filename, "prediction": results[0][0], "confidence": float(results[0][1])})
+    return {"results": results, "cache": cache_status, "stage": stage, "key": key, "input_batch": input_batch,
+            "embedding": embedding, "explanation": explanation}
+
+def predict_response(data, filename, values, serving, profile=False):
+    """(JSON body, status) of /predict for one admitted upload, shared by app.py and asgi.py.
+
+    ``values`` holds the request's parameters (embedding, explain, tta), ``serving`` is what
+    ``model_version`` yields and ``profile`` traces this request alone.
+    """
+    mv, run_backend, run_batcher, use_cascade, fingerprint = serving
+    want_embedding = values.get("embedding") == "1"
+    explain = values.get("explain", "0")
+    if explain not in ("0", "1", "png"):
+        return {"error": "explain must be 1 (heatmap) or png (heatmap and overlay)"}, 400
+    trace_id = None
+    if profile:
+        # Profiled requests skip the cache and batcher so the trace covers this image alone
+        with profiler.trace() as trace_id:
+            with record_function("load_image"):
+                input_batch = load_image(data)
+            results = predict_image(input_batch, run_backend, topk=len(CLASS_NAMES))
+        want_embedding, explain = False, "0"
+        outcome = {"results": results, "cache": "bypass", "stage": None, "key": None, "input_batch": input_batch,
+                   "embedding": None, "explanation": None}
+    else:
+        want_heatmap = explain != "0"
+        if want_embedding and not supports_embeddings(run_backend):
+            return {"error": "Embeddings need the eager backend"}, 400
+        if want_heatmap and not supports_explanations(run_backend):
+            return {"error": "Explanations need the eager backend and a float classifier head"}, 400
+        outcome = predict_upload(data, filename, mv, run_backend, run_batcher, use_cascade, fingerprint,
+                                 want_embedding, want_heatmap)
+    results = outcome["results"]
+    if not results:
+        return {"error": "No prediction results"}, 500
+    tta = None
+    stage = outcome["stage"]
+    if values.get("tta") == "1":
+        image = data if outcome["input_batch"] is None else outcome["input_batch"]
+        # A screening-model answer is not averaged with ResNeXt50's views: the plain
+        # probabilities are recomputed on the full model, which then gives the answer
+        plain = None if stage == "screen" else results
+        tta = tta_lookup(outcome["key"], image, plain, run_backend)
+        if stage == "screen":
+            stage = "full"
+
+    with STAGE_SECONDS.time(stage="serialize"):
+        response = {
+            "prediction": results[0][0],
+            "confidence": float(results[0][1]),
+            "cache": outcome["cache"],
+            "status": "success"
+        }
+        if mv is not None:
+            response["model"] = {"name": mv.name, "version": mv.version}
+        if stage is not None:
+            response["stage"] = stage
+        if want_embedding:
+            response["embedding"] = [float(v) for v in outcome["embedding"]]
+        explanation = outcome["explanation"]
+        if explanation is not None:
+            response["explanation"] = dict(explanation)
+            if explain == "png":
+                if hasattr(data, "seek"):
+                    data.seek(0)
+                overlay = heatmap_overlay(data, explanation["heatmap"])
+                response["explanation"]["overlay_png"] = base64.b64encode(overlay).decode("ascii")
+        if tta is not None:
+            response.update(prediction=tta["prediction"], confidence=tta["confidence"], tta=tta)
+        if trace_id is not None:
+            response["trace_id"] = trace_id
+    return response, 200
+
+def process_job_images(route, images):
+    """JobQueue callback: classify one batch of queued (filename, bytes) pairs for a (model, version, topk) route"""
+    name, version, topk = route
+    with model_version(name, version) as (mv, run_backend, _, use_cascade, fingerprint):
+        entries = classify_items(images, topk, run_backend, use_cascade, fingerprint)
+    if mv is not None:
+        for entry in entries:
+            entry["model"] = {"name": mv.name, "version": mv.version}
+    return entries
+
+job_queue = JobQueue(process_job_images, JOB_WORKERS, PREDICT_CHUNK_SIZE, JOB_MAX_JOBS, JOB_TTL_SECONDS,
+                     JOB_MAX_QUEUED_IMAGES, JOB_DIR)
+
+def format_results(results):
+    return {
+        "prediction": results[0][0],
+        "confidence": float(results[0][1]),
+        "topk": [{"label": label, "confidence": float(prob)} for label, prob in results],
+    }
+
+# Request metrics; inference stage timings are recorded in predict.py/batcher.py
+REQUESTS = metrics.counter("http_requests_total", "HTTP requests by endpoint and status", ["endpoint", "status"])
+REQUEST_ERRORS = metrics.counter("http_request_errors_total", "HTTP requests answered with 4xx/5xx",
+                                 ["endpoint", "status"])
+REQUEST_SECONDS = metrics.histogram("http_request_seconds", "End-to-end request latency", ["endpoint"])
+metrics.gauge("model_loaded", "1 when a model is loaded", function=lambda: int(model is not None))
+metrics.gauge("model_ready", "1 once loading and warm-up have finished", function=lambda: int(ready))
+metrics.gauge("batcher_queue_depth", "Requests waiting for the micro-batcher",
+              function=lambda: batcher.queue_depth() if batcher is not None else 0)
+metrics.gauge("job_queue_depth", "Job images waiting for a worker", function=lambda: job_queue.queue_depth())
+metrics.counter("prediction_cache_hits_total", "Prediction cache hits",
+                function=lambda: cache.hits if cache is not None else 0)
+metrics.counter("prediction_cache_misses_total", "Prediction cache misses",
+                function=lambda: cache.misses if cache is not None else 0)
+metrics.gauge("startup_phase_seconds", "Duration of each start-up phase", ["phase"],
+              function=lambda: {(phase,): ms / 1000.0 for phase, ms in STARTUP_TIMINGS.items()})
+
+def request_limit(path):
+    """Largest request body accepted on ``path``"""
+    if path in SINGLE_IMAGE_ROUTES:
+        return min(MAX_IMAGE_BYTES + MULTIPART_OVERHEAD_BYTES, MAX_REQUEST_BYTES)
+    return MAX_REQUEST_BYTES
+
+@app.errorhandler(RequestEntityTooLarge)
+def request_too_large(e):
+    limit = request.max_content_length
+    error = reject("request_too_large", f"Request body is larger than {limit} bytes",
+                   request.content_length or 0, 413, limit=limit)
+    return jsonify(error.to_dict()), error.status
+
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+    # Checked against Content-Length when the form is parsed, before any of the body is buffered
+    request.max_content_length = request_limit(request.path)
+
+@app.after_request
+def record_request(response):
+    endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    if endpoint != "/metrics":
+        REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+        if response.status_code >= 400:
+            REQUEST_ERRORS.inc(endpoint=endpoint, status=response.status_code)
+        REQUEST_SECONDS.observe(time.perf_counter() - g.request_started, endpoint=endpoint)
+    return response
+
+def serve_asset(path):
+    asset = assets.get(path)
+    if asset is None:
+        return jsonify({"error": "Not found"}), 404
+    status, headers, body = frontend.respond(asset, request.headers.get("Accept-Encoding"),
+                                             request.headers.get("If-None-Match"))
+    return Response(body, status, headers)
 
 @app.route("/")
 def home():
-    # Serve HTML directly without template
-    return '''
-    <!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Image Classification</title>
-    <style>
-        * { margin: 0; padding: 0; box-sizing: border-box; }
-        body { 
-            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            min-height: 100vh; display: flex; justify-content: center; align-items: center; padding: 20px;
-        }
-        .container { 
-            background: white; border-radius: 15px; box-shadow: 0 15px 35px rgba(0,0,0,0.1);
-            padding: 40px; max-width: 500px; width: 100%; text-align: center;
-        }
-        h1 { color: #333; margin-bottom: 10px; font-size: 2.2em; }
-        .subtitle { color: #666; margin-bottom: 30px; font-size: 1.1em; }
-        .upload-area { 
-            border: 2px dashed #ddd; border-radius: 10px; padding: 40px 20px; margin-bottom: 30px;
-            cursor: pointer; transition: all 0.3s ease; background: #fafafa;
-        }
-        .upload-area:hover { border-color: #667eea; background: #f0f4ff; }
-        .upload-area.highlight { border-color: #667eea; background: #f0f4ff; }
-        .upload-icon { font-size: 48px; color: #667eea; margin-bottom: 15px; }
-        .upload-text { color: #666; margin-bottom: 15px; }
-        #file-input { display: none; }
-        .browse-btn { 
-            background: #667eea; color: white; border: none; padding: 12px 30px; border-radius: 25px;
-            cursor: pointer; font-size: 1em; transition: background 0.3s ease;
-        }
-        .browse-btn:hover { background: #5a6fd8; }
-        .preview-container { margin-bottom: 20px; display: none; }
-        #image-preview { max-width: 100%; max-height: 300px; border-radius: 10px; box-shadow: 0 5px 15px rgba(0,0,0,0.1); }
-        .predict-btn { 
-            background: #28a745; color: white; border: none; padding: 15px 40px; border-radius: 25px;
-            cursor: pointer; font-size: 1.1em; transition: background 0.3s ease; display: none; margin: 0 auto;
-        }
-        .predict-btn:hover { background: #218838; }
-        .predict-btn:disabled { background: #6c757d; cursor: not-allowed; }
-        .results { margin-top: 30px; padding: 20px; border-radius: 10px; background: #f8f9fa; display: none; }
-        .result-title { color: #333; margin-bottom: 15px; font-size: 1.3em; }
-        .prediction { font-size: 1.4em; font-weight: bold; color: #28a745; margin-bottom: 10px; }
-        .confidence { font-size: 1.1em; color: #666; }
-        .error { color: #dc3545; background: #f8d7da; padding: 15px; border-radius: 8px; margin-top: 20px; display: none; }
-        .loading { display: none; margin: 20px 0; }
-        .spinner { 
-            border: 4px solid #f3f3f3; border-top: 4px solid #667eea; border-radius: 50%;
-            width: 40px; height: 40px; animation: spin 1s linear infinite; margin: 0 auto;
-        }
-        @keyframes spin { 0% { transform: rotate(0deg); } 100% { transform: rotate(360deg); } }
-    </style>
-</head>
-<body>
-    <div class="container">
-        <h1>Image Classification</h1>
-        <p class="subtitle">Upload an image to classify using our AI model</p>
-        
-        <div class="upload-area" id="upload-area">
-            <div class="upload-icon">📁</div>
-            <p class="upload-text">Drag & drop your image here or click to browse</p>
-            <button class="browse-btn" onclick="document.getElementById('file-input').click()">Browse Files</button>
-            <input type="file" id="file-input" accept="image/*">
-        </div>
-        
-        <div class="preview-container" id="preview-container">
-            <img id="image-preview" alt="Image preview">
-        </div>
-        
-        <button class="predict-btn" id="predict-btn" onclick="predictImage()">Predict Image</button>
-        
-        <div class="loading" id="loading">
-            <div class="spinner"></div>
-            <p>Analyzing image...</p>
-        </div>
-        
-        <div class="results" id="results">
-            <h3 class="result-title">Prediction Result</h3>
-            <div class="prediction" id="prediction-text"></div>
-            <div class="confidence" id="confidence-text"></div>
-        </div>
-        
-        <div class="error" id="error-message"></div>
-    </div>
-
-    <script>
-        const uploadArea = document.getElementById('upload-area');
-        const fileInput = document.getElementById('file-input');
-        const previewContainer = document.getElementById('preview-container');
-        const imagePreview = document.getElementById('image-preview');
-        const predictBtn = document.getElementById('predict-btn');
-        const results = document.getElementById('results');
-        const predictionText = document.getElementById('prediction-text');
-        const confidenceText = document.getElementById('confidence-text');
-        const errorMessage = document.getElementById('error-message');
-        const loading = document.getElementById('loading');
-        
-        let currentFile = null;
-        
-        ['dragenter', 'dragover', 'dragleave', 'drop'].forEach(eventName => {
-            uploadArea.addEventListener(eventName, preventDefaults, false);
-        });
-        
-        function preventDefaults(e) { e.preventDefault(); e.stopPropagation(); }
-        
-        ['dragenter', 'dragover'].forEach(eventName => { uploadArea.addEventListener(eventName, highlight, false); });
-        ['dragleave', 'drop'].forEach(eventName => { uploadArea.addEventListener(eventName, unhighlight, false); });
-        
-        function highlight() { uploadArea.classList.add('highlight'); }
-        function unhighlight() { uploadArea.classList.remove('highlight'); }
-        
-        uploadArea.addEventListener('drop', handleDrop, false);
-        function handleDrop(e) { const files = e.dataTransfer.files; handleFiles(files); }
-        
-        fileInput.addEventListener('change', function() { handleFiles(this.files); });
-        
-        function handleFiles(files) {
-            if (files.length > 0) {
-                const file = files[0];
-                if (file.type.startsWith('image/')) {
-                    currentFile = file;
-                    showPreview(file);
-                    hideError();
-                    hideResults();
-                    predictBtn.style.display = 'block';
-                } else { showError('Please select a valid image file.'); }
-            }
-        }
-        
-        function showPreview(file) {
-            const reader = new FileReader();
-            reader.onload = function(e) { imagePreview.src = e.target.result; previewContainer.style.display = 'block'; };
-            reader.readAsDataURL(file);
-        }
-        
-        function predictImage() {
-            if (!currentFile) { showError('Please select an image first.'); return; }
-            const formData = new FormData(); formData.append('image', currentFile);
-            showLoading(); hideError(); hideResults(); predictBtn.disabled = true;
-            fetch('/predict', { method: 'POST', body: formData })
-            .then(response => response.json())
-            .then(data => {
-                hideLoading(); predictBtn.disabled = false;
-                if (data.error) { showError(data.error); } else { showResults(data.prediction, data.confidence); }
-            })
-            .catch(error => { hideLoading(); predictBtn.disabled = false; showError('Network error: ' + error.message); });
-        }
-        
-        function showLoading() { loading.style.display = 'block'; }
-        function hideLoading() { loading.style.display = 'none'; }
-        function showResults(prediction, confidence) {
-            predictionText.textContent = prediction;
-            confidenceText.textContent = `Confidence: ${(confidence * 100).toFixed(2)}%`;
-            results.style.display = 'block';
-        }
-        function hideResults() { results.style.display = 'none'; }
-        function showError(message) { errorMessage.textContent = message; errorMessage.style.display = 'block'; }
-        function hideError() { errorMessage.style.display = 'none'; }
-        
-        uploadArea.addEventListener('click', function(e) {
-            if (e.target !== this.querySelector('.browse-btn')) { fileInput.click(); }
-        });
-    </script>
-</body>
-</html>
-    '''
+    return serve_asset("/")
+
+@app.route("/static/<path:name>")
+def static_asset(name):
+    return serve_asset(frontend.STATIC_PREFIX + name)
 
 @app.route("/predict", methods=["POST"])
 def predict_api():
     if model is None:
         return jsonify({"error": "Model not loaded"}), 500
     
-    if "image" not in request.files:
+    with STAGE_SECONDS.time(stage="upload_read"):
+        files = request.files
+    if "image" not in files:
         return jsonify({"error": "No image uploaded"}), 400
     
-    file = request.files["image"]
+    file = files["image"]
     
     if file.filename == "":
         return jsonify({"error": "No file selected"}), 400
     
-    if file and allowed_file(file.filename):
+    try:
+        check_image(file.stream)
+    except AdmissionError as e:
+        return jsonify(e.to_dict()), e.status
+
+    try:
+        with serving_version() as serving:
+            response, status = predict_response(file.stream, file.filename, request.values, serving,
+                                                profiler.should_profile(profile_requested()))
+        return jsonify(response), status
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        return jsonify({"error": f"Prediction failed: {str(e)}"}), 500
+
+@app.route("/predict/batch", methods=["POST"])
+def predict_batch_api():
+    if model is None:
+        return jsonify({"error": "Model not loaded"}), 500
+
+    files = [f for f in request.files.getlist("images") + request.files.getlist("image") if f.filename]
+    if not files:
+        return jsonify({"error": "No images uploaded"}), 400
+
+    try:
+        items = collect_batch_items(files)
+    except AdmissionError as e:
+        return jsonify(e.to_dict()), e.status
+
+    topk = read_topk()
+    try:
+        with serving_version() as (mv, run_backend, _, use_cascade, fingerprint):
+            entries = classify_items(items, topk, run_backend, use_cascade, fingerprint)
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        return jsonify({"error": f"Prediction failed: {str(e)}"}), 500
+
+    response = {
+        "results": entries,
+        "count": len(entries),
+        "failed": sum(1 for entry in entries if entry["status"] == "error"),
+        "status": "success"
+    }
+    if mv is not None:
+        response["model"] = {"name": mv.name, "version": mv.version}
+    return jsonify(response)
+
+@app.route("/jobs", methods=["POST"])
+def submit_job():
+    """Queue images (files and zips, as for /predict/batch) and return a job ID without waiting"""
+    if model is None:
+        return jsonify({"error": "Model not loaded"}), 500
+
+    files = [f for f in request.files.getlist("images") + request.files.getlist("image") if f.filename]
+    if not files:
+        return jsonify({"error": "No images uploaded"}), 400
+
+    try:
+        items = collect_batch_items(files)
+    except AdmissionError as e:
+        return jsonify(e.to_dict()), e.status
+    if registry is not None and request.values.get("version") is not None:
         try:
-            img_path = os.path.join(app.config['UPLOAD_FOLDER'], 'temp.jpg')
-            file.save(img_path)
-            results = predict_image(img_path, model)
-            
-            if os.path.exists(img_path):
-                os.remove(img_path)
-            
-            if results and len(results) > 0:
-                return jsonify({
-                    "prediction": results[0][0], 
-                    "confidence": float(results[0][1]),
-                    "status": "success"
-                })
+            registry.get(request.values.get("model"), request.values["version"])
+        except LookupError as e:
+            return jsonify({"error": str(e)}), 404
+
+    queued = []
+    for name, image in items:
+        if isinstance(image, (str, AdmissionError)):
+            queued.append((name, error_entry(name, image)))
+        else:
+            # Upload streams are closed with the request, so the queue keeps its own copy of the bytes
+            queued.append((name, image if isinstance(image, bytes) else image.getvalue()))
+    route = (request.values.get("model"), request.values.get("version"), read_topk())
+    job = job_queue.submit(queued, route)
+    if job is None:
+        return jsonify({"error": "Job queue is full, retry later"}), 503, {"Retry-After": "5"}
+    return jsonify({
+        "job_id": job.id,
+        "total": job.total,
+        "status_url": f"/jobs/{job.id}",
+        "events_url": f"/jobs/{job.id}/events",
+        "status": "queued"
+    }), 202
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown or expired job"}), 404
+    return jsonify(job.info())
+
+@app.route("/jobs/<job_id>/events")
+def job_events(job_id):
+    """Server-Sent Events: one "result" per finished image, then "done"; resumes from Last-Event-ID"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown or expired job"}), 404
+    try:
+        cursor = int(request.headers.get("Last-Event-ID", -1)) + 1
+    except ValueError:
+        cursor = 0
+
+    def stream(cursor):
+        while True:
+            events, done = job.events_since(cursor, JOB_HEARTBEAT_SECONDS)
+            if not events and not done:
+                yield ": keep-alive\n\n"
+            for event, data in events:
+                yield f"id: {cursor}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+                cursor += 1
+            if done and not events:
+                return
+
+    return Response(stream(cursor), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route("/stats/jobs")
+def job_stats():
+    return jsonify(job_queue.stats())
+
+@app.route("/predict/study", methods=["POST"])
+def predict_study_api():
+    """Study-level prediction for a volume (multi-frame TIFF, .npy or .npz), scored slice by slice"""
+    if model is None:
+        return jsonify({"error": "Model not loaded"}), 500
+
+    file = request.files.get("study") or request.files.get("image")
+    if file is None or file.filename == "":
+        return jsonify({"error": "No study uploaded"}), 400
+    ext = file.filename.rsplit('.', 1)[-1].lower() if '.' in file.filename else ''
+    if ext not in VOLUME_EXTENSIONS:
+        return jsonify({"error": f"Invalid file type. Allowed types: {', '.join(sorted(VOLUME_EXTENSIONS))}"}), 400
+
+    aggregate = request.values.get("aggregate", "topk")
+    if aggregate not in ("topk", "mean", "max"):
+        return jsonify({"error": "aggregate must be topk, mean or max"}), 400
+    window = None
+    if request.values.get("window"):
+        try:
+            low, high = (float(v) for v in request.values["window"].split(","))
+        except ValueError:
+            return jsonify({"error": "window must be low,high"}), 400
+        if not high > low:
+            return jsonify({"error": "window high must be greater than low"}), 400
+        window = (low, high)
+    array_key = request.values.get("key")
+
+    try:
+        with serving_version() as (mv, run_backend, _, _, fingerprint):
+            key = None
+            result = None
+            if cache is not None:
+                # Parameters are hashed, never embedded: they are client-supplied and keys become file names
+                params = json.dumps([aggregate, array_key if ext == "npz" else None, window])
+                key = f"{cache.key(file.stream, fingerprint)}-study-{hash_bytes(params.encode())[:16]}"
+                result = cache.get_value(key)
+            cache_status = "off" if cache is None else ("miss" if result is None else "hit")
+            if result is None:
+                # Opened by path so .npy data is memory-mapped and TIFF frames are read from disk;
+                # slices already arrive in full batches, so they go straight to the model, not the batcher
+                fd, path = tempfile.mkstemp(suffix=f".{ext}")
+                try:
+                    with os.fdopen(fd, 'wb') as out:
+                        file.stream.seek(0)
+                        shutil.copyfileobj(file.stream, out, 1 << 20)
+                    with open_volume(path, file.filename, array_key) as volume:
+                        result = score_volume(volume, run_backend, VOLUME_BATCH_SIZE, window, aggregate)
+                finally:
+                    os.remove(path)
+                if key is not None:
+                    cache.put_value(key, result)
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    except (ValueError, OSError) as e:
+        return jsonify({"error": f"Could not read study: {e}"}), 400
+    except Exception as e:
+        return jsonify({"error": f"Prediction failed: {str(e)}"}), 500
+
+    response = dict(result, cache=cache_status, status="success")
+    if mv is not None:
+        response["model"] = {"name": mv.name, "version": mv.version}
+    return jsonify(response)
+
+@app.route("/admin/profile", methods=["GET", "POST"])
+def profile_admin():
+    if not profile_token_ok(request.headers.get(PROFILE_HEADER)):
+        return profile_denied()
+    if request.method == "POST":
+        payload = request.get_json(silent=True) or request.values
+        try:
+            profiler.arm(int(payload.get("requests", 1)))
+        except (TypeError, ValueError):
+            return jsonify({"error": "requests must be an integer"}), 400
+    return jsonify(profiler.stats())
+
+@app.route("/admin/profile/<trace_id>")
+def profile_trace(trace_id):
+    if not profile_token_ok(request.headers.get(PROFILE_HEADER)):
+        return profile_denied()
+    if trace_id not in profiler.traces():
+        return jsonify({"error": "Unknown trace"}), 404
+    return send_file(os.path.abspath(profiler.path(trace_id)), mimetype="application/json")
+
+@app.route("/metrics")
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype=None, content_type=metrics.CONTENT_TYPE)
+
+@app.route("/config/upload")
+def upload_config():
+    """Client-side resize settings for the web UI"""
+    return jsonify({
+        "max_side": UPLOAD_MAX_SIDE,
+        "quality": UPLOAD_QUALITY,
+        "types": ["image/webp", "image/jpeg"] if WEBP else ["image/jpeg"],
+        "max_bytes": MAX_IMAGE_BYTES,
+    })
+
+@app.route("/ready")
+def readiness():
+    if not ready:
+        return jsonify({"status": "starting", "startup_timings_ms": STARTUP_TIMINGS}), 503
+    return jsonify({"status": "ready", "startup_timings_ms": STARTUP_TIMINGS})
+
+@app.route("/stats/batching")
+def batching_stats():
+    if batcher is None:
+        return jsonify({"error": "Model not loaded"}), 500
+    return jsonify(batcher.stats())
+
+def single_worker_only():
+    # Each worker has its own registry; a change here would reach only the worker that got the request
+    return jsonify({"error": f"Model changes would apply to 1 of {worker_count} workers; declare versions and "
+                             "traffic in MODEL_REGISTRY (loaded before forking) or run a single worker"}), 409
+
+@app.route("/admin/models", methods=["GET", "POST"])
+def models_admin():
+    """GET lists versions and traffic; POST {name, version, path, arch, activate} loads one in the background"""
+    if not admin_token_ok():
+        return admin_denied()
+    if registry is None:
+        return jsonify({"error": "Model not loaded"}), 500
+    if request.method == "GET":
+        return jsonify(registry.stats())
+    if worker_count > 1:
+        return single_worker_only()
+    payload = request.get_json(silent=True) or {}
+    name = payload.get("name") or MODEL_NAME
+    if "version" not in payload or "path" not in payload:
+        return jsonify({"error": "version and path are required"}), 400
+    version = str(payload["version"])
+    try:
+        mv = registry.register(name, version, payload["path"], payload.get("arch", "resnext50_32x4d"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 409
+    registry.load_async(name, version, activate=bool(payload.get("activate", False)))
+    return jsonify({"name": name, "version": version, **mv.info()}), 202
+
+@app.route("/admin/models/traffic", methods=["POST"])
+def models_traffic():
+    """Replace a model's traffic split, e.g. {"name": "resnext50", "weights": {"1": 90, "2": 10}}"""
+    if not admin_token_ok():
+        return admin_denied()
+    if registry is None:
+        return jsonify({"error": "Model not loaded"}), 500
+    if worker_count > 1:
+        return single_worker_only()
+    payload = request.get_json(silent=True) or {}
+    try:
+        registry.set_traffic(payload.get("name") or MODEL_NAME, payload.get("weights") or {})
+    except (LookupError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(registry.stats())
+
+@app.route("/search", methods=["POST"])
+def search_api():
+    """Most similar stored cases to an uploaded image, by cosine similarity of embeddings"""
+    if model is None:
+        return jsonify({"error": "Model not loaded"}), 500
+    file = request.files.get("image")
+    if file is None or file.filename == "":
+        return jsonify({"error": "No image uploaded"}), 400
+    try:
+        check_image(file.stream)
+    except AdmissionError as e:
+        return jsonify(e.to_dict()), e.status
+    try:
+        k = min(max(int(request.values.get("k", 10)), 1), 100)
+        nprobe = max(int(request.values.get("nprobe", 8)), 1)
+    except ValueError:
+        return jsonify({"error": "k and nprobe must be integers"}), 400
+    mode = request.values.get("mode", "auto")
+    if mode not in ("auto", "exact", "ivf"):
+        return jsonify({"error": "mode must be auto, exact or ivf"}), 400
+    try:
+        with serving_version() as (mv, run_backend, run_batcher, _, _):
+            if not supports_embeddings(run_backend):
+                return jsonify({"error": "Embeddings need the eager backend"}), 400
+            store = embedding_store(mv)
+            if store is None:
+                return jsonify({"error": "No embedding store for this model"}), 404
+            image_hash = hash_bytes(file.stream)
+            row = store.find(image_hash)
+            if row is not None:
+                query = store.vector(row)
             else:
-                return jsonify({"error": "No prediction results"}), 500
-                
-        except Exception as e:
-            img_path = os.path.join(app.config['UPLOAD_FOLDER'], 'temp.jpg')
-            if os.path.exists(img_path):
-                os.remove(img_path)
-            return jsonify({"error": f"Prediction failed: {str(e)}"}), 500
-    else:
-        return jsonify({"error": "Invalid file type. Allowed types: png, jpg, jpeg, gif"}), 400
+                _, outputs = run_batcher.predict(load_image(file.stream), topk=1, extras=("embedding",))
+                query = outputs["embedding"]
+            matches = [(r, score) for r, score in store.search(query, k + 1, mode, nprobe) if r != row][:k]
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": f"Search failed: {str(e)}"}), 500
+    metadata = store.metadata([r for r, _ in matches])
+    return jsonify({
+        "results": [{"row": r, "score": score, **meta} for (r, score), meta in zip(matches, metadata)],
+        "searched_rows": len(store),
+        "status": "success"
+    })
+
+@app.route("/admin/embeddings/index", methods=["POST"])
+def embeddings_index():
+    """(Re)build the approximate IVF index of the serving model's store, e.g. {"lists": 1024}"""
+    if not admin_token_ok():
+        return admin_denied()
+    store = embedding_store(registry.primary() if registry is not None else None)
+    if store is None:
+        return jsonify({"error": "No embedding store for this model"}), 404
+    payload = request.get_json(silent=True) or {}
+    try:
+        return jsonify(store.build_index(payload.get("lists")))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route("/stats/embeddings")
+def embeddings_stats():
+    store = embedding_store(registry.primary() if registry is not None else None)
+    if store is None:
+        return jsonify({"status": "disabled"})
+    return jsonify(store.stats())
+
+@app.route("/stats/cascade")
+def cascade_stats():
+    if cascade is None:
+        return jsonify({"status": "disabled"})
+    return jsonify(cascade.stats())
+
+@app.route("/stats/cache")
+def cache_stats():
+    if cache is None:
+        return jsonify({"backend": None, "status": "disabled"})
+    return jsonify(cache.stats())
 
 if __name__ == "__main__":
     load_model()
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    app.run(debug=True, host='0.0.0.0', port=5000)
+elif os.environ.get("LOAD_MODEL_ON_IMPORT") == "1":
+    # WSGI servers (gunicorn app:app) only import the module
+    load_model_async()
\ No newline at end of file
@@ -0,0 +1,395 @@
+"""Asyncio (ASGI) serving mode with the same /predict contract as app.py.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+
+Uploads are read from the event loop without blocking it and parsed
+incrementally. Admitted requests wait in a bounded queue; when it is full the
+request is answered immediately with 503 and Retry-After instead of piling up.
+Dispatchers hand queued work to a dedicated thread pool, which runs the same
+prediction path as app.py (registry version, cascade, cache, micro-batcher and
+embedding recording), and drop work whose deadline has passed or whose client
+has disconnected before it reaches the model.
+
+Every other route (batch and study prediction, /jobs and its event stream,
+/config/upload, search, admin) is served by app.py's Flask app on a separate
+thread pool, so the web UI served from here works exactly as under app.py.
+"""
+import asyncio
+import io
+import json
+import os
+import time
+from urllib.parse import parse_qs
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+
+import app as webapp
+import frontend
+from admission import AdmissionError, check_image, reject
+import metrics
+
+# Admission queue size, inference threads and per-request deadline
+INFERENCE_QUEUE_SIZE = int(os.environ.get("INFERENCE_QUEUE_SIZE", 64))
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", webapp.MAX_BATCH_SIZE))
+REQUEST_TIMEOUT_MS = float(os.environ.get("REQUEST_TIMEOUT_MS", 30000))
+RETRY_AFTER_SECONDS = int(os.environ.get("RETRY_AFTER_SECONDS", 1))
+MAX_BODY_BYTES = int(os.environ.get("ASGI_MAX_BODY_BYTES", webapp.request_limit("/predict")))
+# Threads running the Flask routes that have no native handler here
+WSGI_THREADS = int(os.environ.get("ASGI_WSGI_THREADS", 32))
+
+
+class BadRequest(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class Job:
+    __slots__ = ("args", "deadline", "future", "disconnected")
+
+    def __init__(self, args, deadline, future):
+        # infer(*args)
+        self.args = args
+        self.deadline = deadline
+        self.future = future
+        self.disconnected = False
+
+
+class InferenceServer:
+    def __init__(self, queue_size=INFERENCE_QUEUE_SIZE, workers=INFERENCE_WORKERS):
+        self.queue_size = queue_size
+        self.workers = workers
+        self.queue = None
+        self.executor = None
+        self.dispatchers = []
+        self.dropped_expired = 0
+        self.dropped_disconnected = 0
+        self.rejected = 0
+
+    async def start(self):
+        if self.queue is not None:
+            return
+        self.queue = asyncio.Queue(self.queue_size)
+        self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix="inference")
+        if webapp.model is None:
+            await asyncio.get_running_loop().run_in_executor(self.executor, webapp.load_model)
+        self.dispatchers = [asyncio.create_task(self._dispatch()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self.dispatchers:
+            task.cancel()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+
+    def admit(self, args, deadline):
+        """Queue ``infer(*args)``; returns the Job, or None when the queue is full"""
+        job = Job(args, deadline, asyncio.get_running_loop().create_future())
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return None
+        return job
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self.queue.get()
+            try:
+                if job.disconnected:
+                    self.dropped_disconnected += 1
+                    continue
+                # Cancelled: the request already gave up waiting for it
+                if job.future.cancelled() or time.monotonic() > job.deadline:
+                    self.dropped_expired += 1
+                    if not job.future.done():
+                        job.future.set_exception(TimeoutError("Deadline expired while queued"))
+                    continue
+                try:
+                    result = await loop.run_in_executor(self.executor, infer, *job.args)
+                except Exception as e:
+                    if not job.future.done():
+                        job.future.set_exception(e)
+                else:
+                    if not job.future.done():
+                        job.future.set_result(result)
+            finally:
+                self.queue.task_done()
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue.qsize() if self.queue is not None else 0,
+            "queue_size": self.queue_size,
+            "workers": self.workers,
+            "rejected": self.rejected,
+            "dropped_expired": self.dropped_expired,
+            "dropped_disconnected": self.dropped_disconnected,
+        }
+
+
+def infer(data, filename, values, profile=False):
+    """Runs on the inference pool: app.py's /predict path on the pinned or traffic-routed version"""
+    with webapp.model_version(values.get("model"), values.get("version")) as serving:
+        return webapp.predict_response(io.BytesIO(data), filename, values, serving, profile)
+
+
+server = InferenceServer()
+
+
+metrics.counter("asgi_rejected_total", "Requests refused with 503 because the queue was full",
+                function=lambda: server.rejected)
+metrics.counter("asgi_dropped_total", "Queued requests dropped before inference", ["reason"],
+                function=lambda: {("expired",): server.dropped_expired,
+                                  ("disconnected",): server.dropped_disconnected})
+metrics.gauge("asgi_queue_depth", "Requests waiting in the admission queue",
+              function=lambda: server.queue.qsize() if server.queue is not None else 0)
+
+
+async def send_json(send, status, payload, headers=()):
+    body = json.dumps(payload).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode())] + list(headers),
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def read_upload(scope, receive, field="image"):
+    """Stream the multipart body and return (filename, bytes, {name: value}) of the ``field`` file
+    and the text fields"""
+    headers = dict(scope["headers"])
+    content_type, options = parse_options_header(headers.get(b"content-type", b"").decode("latin-1"))
+    if content_type != "multipart/form-data" or "boundary" not in options:
+        raise BadRequest("No image uploaded")
+    decoder = MultipartDecoder(options["boundary"].encode("latin-1"))
+    filename, data, capturing = None, bytearray(), False
+    fields, field_name = {}, None
+    received, more_body = 0, True
+    while True:
+        event = decoder.next_event()
+        if isinstance(event, NeedData):
+            if not more_body:
+                break
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                raise ConnectionResetError("Client disconnected during upload")
+            chunk = message.get("body", b"")
+            received += len(chunk)
+            if received > MAX_BODY_BYTES:
+                raise reject("request_too_large", f"Request body is larger than {MAX_BODY_BYTES} bytes",
+                             received, 413, limit=MAX_BODY_BYTES)
+            more_body = message.get("more_body", False)
+            decoder.receive_data(chunk)
+            if not more_body:
+                decoder.receive_data(None)
+        elif isinstance(event, Field):
+            capturing = False
+            field_name = event.name
+        elif isinstance(event, File):
+            capturing, field_name = event.name == field and filename is None, None
+            if capturing:
+                filename = event.filename or ""
+        elif isinstance(event, Data):
+            if capturing:
+                data += event.data
+                capturing = event.more_data
+            elif field_name is not None:
+                fields[field_name] = fields.get(field_name, "") + event.data.decode("utf-8", "replace")
+        elif isinstance(event, Epilogue):
+            break
+    if filename is None:
+        raise BadRequest("No image uploaded")
+    return filename, bytes(data), fields
+
+
+async def watch_disconnect(receive, job):
+    message = await receive()
+    if message["type"] == "http.disconnect":
+        job.disconnected = True
+
+
+async def predict(scope, receive, send):
+    if webapp.model is None:
+        return await send_json(send, 500, {"error": "Model not loaded"})
+    try:
+        filename, data, fields = await read_upload(scope, receive)
+    except BadRequest as e:
+        return await send_json(send, e.status, {"error": str(e)})
+    except AdmissionError as e:
+        return await send_json(send, e.status, e.to_dict())
+    except ConnectionResetError:
+        return
+    if filename == "":
+        return await send_json(send, 400, {"error": "No file selected"})
+    try:
+        check_image(data)
+    except AdmissionError as e:
+        return await send_json(send, e.status, e.to_dict())
+
+    # Query parameters take precedence over form fields, as in Flask's request.values
+    query = {k: v[0] for k, v in parse_qs(scope.get("query_string", b"").decode("latin-1")).items()}
+    values = dict(fields, **query)
+
+    headers = dict(scope["headers"])
+    try:
+        timeout_ms = float(headers.get(b"x-request-timeout-ms", REQUEST_TIMEOUT_MS))
+    except ValueError:
+        timeout_ms = REQUEST_TIMEOUT_MS
+    deadline = time.monotonic() + timeout_ms / 1000.0
+
+    profile_header = headers.get(webapp.PROFILE_HEADER.lower().encode())
+    profile = profile_header is not None and webapp.profile_token_ok(profile_header.decode("latin-1"))
+    job = server.admit((data, filename, values, webapp.profiler.should_profile(profile)), deadline)
+    if job is None:
+        return await send_json(send, 503, {"error": "Server busy, retry later"},
+                               [(b"retry-after", str(RETRY_AFTER_SECONDS).encode())])
+    watcher = asyncio.create_task(watch_disconnect(receive, job))
+    try:
+        response, status = await asyncio.wait_for(
+            asyncio.shield(job.future), max(0.0, deadline - time.monotonic()))
+    except (asyncio.TimeoutError, TimeoutError):
+        return await send_json(send, 504, {"error": "Prediction timed out"})
+    except LookupError as e:
+        return await send_json(send, 404, {"error": str(e)})
+    except Exception as e:
+        return await send_json(send, 500, {"error": f"Prediction failed: {str(e)}"})
+    finally:
+        watcher.cancel()
+        # Nobody awaits the job any more: cancel it so it is skipped, and a late result or
+        # exception is not left unretrieved
+        job.future.cancel()
+    if job.disconnected:
+        return
+    await send_json(send, status, response)
+
+
+wsgi_executor = ThreadPoolExecutor(WSGI_THREADS, thread_name_prefix="wsgi")
+
+
+async def call_wsgi(scope, receive, send):
+    """Serve the request with app.py's Flask app, streaming its response (e.g. job events)"""
+    limit = webapp.request_limit(scope["path"])
+    body, more_body = bytearray(), True
+    while more_body:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if len(body) > limit:
+            error = reject("request_too_large", f"Request body is larger than {limit} bytes",
+                           len(body), 413, limit=limit)
+            return await send_json(send, error.status, error.to_dict())
+    server_name, server_port = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", ""),
+        "PATH_INFO": scope["path"],
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server_name,
+        "SERVER_PORT": str(server_port),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": (scope.get("client") or ("", 0))[0],
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(bytes(body)),
+        "wsgi.errors": io.StringIO(),
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope["headers"]:
+        key = name.decode("latin-1").upper().replace("-", "_")
+        if key in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            if key == "CONTENT_TYPE":
+                environ[key] = value.decode("latin-1")
+            continue
+        key = "HTTP_" + key
+        value = value.decode("latin-1")
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started["status"], started["headers"] = int(status.split(" ", 1)[0]), headers
+
+    loop = asyncio.get_running_loop()
+    iterator = await loop.run_in_executor(wsgi_executor, webapp.app, environ, start_response)
+    close = getattr(iterator, "close", lambda: None)
+    disconnected = asyncio.create_task(receive())
+    chunk = None
+    try:
+        chunks = iter(iterator)
+        sent_start = False
+        while True:
+            chunk = asyncio.ensure_future(loop.run_in_executor(wsgi_executor, next, chunks, None))
+            await asyncio.wait((chunk, disconnected), return_when=asyncio.FIRST_COMPLETED)
+            if not chunk.done():
+                # Client went away mid-stream (e.g. closed an event stream)
+                return
+            data = chunk.result()
+            if not sent_start:
+                await send({"type": "http.response.start", "status": started["status"],
+                            "headers": [(k.lower().encode("latin-1"), v.encode("latin-1"))
+                                        for k, v in started["headers"]]})
+                sent_start = True
+            if data is None:
+                return await send({"type": "http.response.body", "body": b""})
+            if data:
+                await send({"type": "http.response.body", "body": data, "more_body": True})
+    finally:
+        disconnected.cancel()
+        if chunk is None or chunk.done():
+            wsgi_executor.submit(close)
+        else:
+            # The response generator cannot be closed while next() is still running on it
+            chunk.add_done_callback(lambda _: wsgi_executor.submit(close))
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await server.start()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await server.stop()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+    await server.start()
+    path, method = scope["path"], scope["method"]
+    if path == "/predict" and method == "POST":
+        return await predict(scope, receive, send)
+    if path == "/ready" and method == "GET":
+        status = 200 if webapp.ready else 503
+        return await send_json(send, status, {"status": "ready" if webapp.ready else "starting",
+                                              "startup_timings_ms": webapp.STARTUP_TIMINGS})
+    if path == "/metrics" and method == "GET":
+        body = metrics.render().encode()
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", metrics.CONTENT_TYPE.encode()),
+                                (b"content-length", str(len(body)).encode())]})
+        return await send({"type": "http.response.body", "body": body})
+    if path == "/stats/queue" and method == "GET":
+        return await send_json(send, 200, server.stats())
+    if method in ("GET", "HEAD") and path in webapp.assets:
+        headers = dict(scope["headers"])
+        status, response_headers, body = frontend.respond(
+            webapp.assets[path], headers.get(b"accept-encoding", b"").decode("latin-1"),
+            headers.get(b"if-none-match", b"").decode("latin-1"), head=method == "HEAD")
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(k.lower().encode(), v.encode()) for k, v in response_headers]})
+        return await send({"type": "http.response.body", "body": body})
+    await call_wsgi(scope, receive, send)
@@ -0,0 +1,167 @@
+"""Interchangeable inference backends for the classifier.
+
+Every backend is a callable taking a (N, 3, 224, 224) float tensor and returning
+(N, num_classes) logits as a torch tensor, so it can be passed anywhere the eager
+model is used (predict_batch, predict_images, MicroBatcher).
+
+    python backends.py path/to/model.pth --backends eager torchscript onnx
+
+exports the artifacts next to the checkpoint and prints per-backend latency.
+"""
+import argparse
+import time
+
+import torch
+
+from predict import build_model, device, load_checkpoint
+from weights import artifact_path, is_fresh, mark_fresh
+
+BACKENDS = ('eager', 'torchscript', 'compile', 'onnx')
+INPUT_SHAPE = (3, 224, 224)
+
+
+def _example_input(batch_size=2):
+    return torch.randn((batch_size,) + INPUT_SHAPE, device=device)
+
+
+def export_torchscript(model, checkpoint_path, force=False):
+    path = artifact_path(checkpoint_path, '.ts')
+    if force or not is_fresh(path, checkpoint_path):
+        with torch.no_grad():
+            traced = torch.jit.trace(model.eval(), _example_input())
+            torch.jit.freeze(traced).save(path)
+        mark_fresh(path, checkpoint_path)
+    return path
+
+
+def export_onnx(model, checkpoint_path, force=False, opset=17):
+    path = artifact_path(checkpoint_path, '.onnx')
+    if force or not is_fresh(path, checkpoint_path):
+        with torch.no_grad():
+            torch.onnx.export(model.eval(), _example_input(), path,
+                              input_names=['input'], output_names=['logits'],
+                              dynamic_axes={'input': {0: 'batch'}, 'logits': {0: 'batch'}},
+                              opset_version=opset, dynamo=False)
+        mark_fresh(path, checkpoint_path)
+    return path
+
+
+class EagerBackend:
+    name = 'eager'
+
+    def __init__(self, model):
+        self.model = model
+
+    def __call__(self, input_batch):
+        return self.model(input_batch)
+
+
+class TorchScriptBackend:
+    name = 'torchscript'
+
+    def __init__(self, path):
+        self.module = torch.jit.load(path, map_location=device)
+        self.module.eval()
+
+    def __call__(self, input_batch):
+        return self.module(input_batch)
+
+
+class CompileBackend:
+    name = 'compile'
+
+    def __init__(self, model, mode=None):
+        self.module = torch.compile(model, mode=mode, dynamic=True)
+
+    def __call__(self, input_batch):
+        return self.module(input_batch)
+
+
+class OnnxBackend:
+    name = 'onnx'
+
+    def __init__(self, path, intra_op_threads=0):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise RuntimeError("The onnx backend requires onnxruntime (pip install onnxruntime)")
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        self.path = path
+        self.session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, input_batch):
+        logits = self.session.run(None, {self.input_name: input_batch.detach().cpu().contiguous().numpy()})[0]
+        return torch.from_numpy(logits).to(input_batch.device)
+
+
+def check_parity(backend, model, atol=1e-3, batch_size=2):
+    """Max absolute logit difference between ``backend`` and the eager model on random input"""
+    torch.manual_seed(0)
+    input_batch = _example_input(batch_size)
+    with torch.no_grad():
+        expected = model(input_batch).float()
+        actual = backend(input_batch).float()
+    diff = (actual - expected).abs().max().item()
+    if not diff <= atol:
+        raise RuntimeError(f"{backend.name} backend output differs from eager: "
+                           f"max |diff| = {diff:.3e} > {atol:.0e}")
+    return diff
+
+
+def load_backend(name, model, checkpoint_path, atol=1e-3, threads=0):
+    """Wrap the loaded eager ``model`` in backend ``name``, exporting artifacts as needed"""
+    if name == 'eager':
+        return EagerBackend(model)
+    if name == 'torchscript':
+        backend = TorchScriptBackend(export_torchscript(model, checkpoint_path))
+    elif name == 'compile':
+        backend = CompileBackend(model)
+    elif name == 'onnx':
+        backend = OnnxBackend(export_onnx(model, checkpoint_path), threads)
+    else:
+        raise ValueError(f"Unknown inference backend: {name} (expected one of {', '.join(BACKENDS)})")
+    diff = check_parity(backend, model, atol)
+    print(f"{name} backend parity vs eager: max |diff| = {diff:.2e}")
+    return backend
+
+
+def _latency_ms(backend, batch_size, repeat):
+    input_batch = _example_input(batch_size)
+    with torch.no_grad():
+        backend(input_batch)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            backend(input_batch)
+    return (time.perf_counter() - start) / repeat * 1000.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the checkpoint and compare backend latency")
+    parser.add_argument('checkpoint')
+    parser.add_argument('--backends', nargs='+', default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--force', action='store_true', help="re-export even if artifacts are fresh")
+    args = parser.parse_args()
+
+    model = load_checkpoint(build_model(empty=True), args.checkpoint)
+    if args.force:
+        export_torchscript(model, args.checkpoint, force=True)
+        export_onnx(model, args.checkpoint, force=True)
+    for name in args.backends:
+        try:
+            backend = load_backend(name, model, args.checkpoint)
+        except Exception as e:
+            print(f"{name}: unavailable ({e})")
+            continue
+        timings = ", ".join(f"batch {n}: {_latency_ms(backend, n, args.repeat):.1f} ms"
+                            for n in args.batch_sizes)
+        print(f"{name}: {timings}")
+
+
+if __name__ == '__main__':
+    main()
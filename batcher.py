@@ -0,0 +1,184 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import torch
+
+from metrics import STAGE_SECONDS
+from predict import explain_batch, predict_batch
+from preprocess import BatchBuffer
+
+
+class _Item:
+    __slots__ = ("tensor", "topk", "extras", "future", "enqueued_at")
+
+    def __init__(self, tensor, topk, extras=()):
+        self.tensor = tensor
+        self.topk = topk
+        self.extras = tuple(extras)
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class MicroBatcher:
+    """Coalesce concurrent single-image requests into one batched forward pass.
+
+    Callers hand in a (1, 3, H, W) tensor and block on their own future. A
+    background thread waits until either ``max_batch_size`` requests are queued
+    or the oldest one has waited ``max_wait_ms``, then runs a single forward and
+    hands each caller its own top-k slice.
+    """
+
+    def __init__(self, model, max_batch_size=16, max_wait_ms=10):
+        self.model = model
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue = deque()
+        self._buffer = BatchBuffer(self.max_batch_size)
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pid = None
+        self._closed = False
+        self._stats_lock = threading.Lock()
+        self._requests = 0
+        self._batches = 0
+        self._last_batch_size = 0
+        self._max_queue_depth = 0
+        self._batch_sizes = {}
+        self._queue_wait_total = 0.0
+        self._forward_total = 0.0
+
+    def _ensure_worker(self):
+        # Threads do not survive fork(), so (re)start the worker lazily in whichever
+        # process actually submits work.
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._cond:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+            self._thread.start()
+
+    def submit(self, tensor, topk=1, extras=()):
+        """Queue a (1, 3, H, W) tensor and return a future resolving to its top-k list.
+
+        ``extras`` may name "embedding" and/or "heatmap" (Grad-CAM); the future then
+        resolves to ``(top-k list, {name: array})``, computed in the shared forward.
+        """
+        if self._closed:
+            raise RuntimeError("Micro-batcher is closed")
+        self._ensure_worker()
+        item = _Item(tensor, topk, extras)
+        with self._cond:
+            self._queue.append(item)
+            depth = len(self._queue)
+            self._cond.notify()
+        with self._stats_lock:
+            self._requests += 1
+            self._max_queue_depth = max(self._max_queue_depth, depth)
+        return item.future
+
+    def predict(self, tensor, topk=1, timeout=None, extras=()):
+        return self.submit(tensor, topk, extras).result(timeout)
+
+    def close(self):
+        """Stop the worker once the queued requests have been served"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._queue:
+                if self._closed:
+                    return None
+                self._cond.wait()
+            deadline = self._queue[0].enqueued_at + self.max_wait
+            while len(self._queue) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            count = min(len(self._queue), self.max_batch_size)
+            return [self._queue.popleft() for _ in range(count)]
+
+    def _run(self):
+        while True:
+            items = self._next_batch()
+            if items is None:
+                return
+            started = time.perf_counter()
+            # Heatmap requests come first and run as their own pass, so a failing
+            # explanation cannot fail the plain requests batched with it
+            items.sort(key=lambda item: "heatmap" not in item.extras)
+            explained = sum(1 for item in items if "heatmap" in item.extras)
+            try:
+                batch = torch.cat([item.tensor for item in items], dim=0, out=self._buffer.view(len(items)))
+                outcomes = []
+                for group, rows in ((items[:explained], batch[:explained]), (items[explained:], batch[explained:])):
+                    if group:
+                        outcomes += self._forward(group, rows)
+            except Exception as e:
+                outcomes = [(item, e) for item in items]
+            finally:
+                self._record(items, started)
+            for item, outcome in outcomes:
+                if isinstance(outcome, Exception):
+                    item.future.set_exception(outcome)
+                else:
+                    item.future.set_result(outcome)
+
+    def _forward(self, items, batch):
+        """(item, result or exception) for each item of one pass"""
+        try:
+            topk = max(item.topk for item in items)
+            extras = {name for item in items for name in item.extras}
+            outputs = {}
+            if "heatmap" in extras:
+                results, outputs["embedding"], outputs["heatmap"] = explain_batch(batch, self.model, topk)
+            elif "embedding" in extras:
+                results, outputs["embedding"] = predict_batch(batch, self.model, topk, features=True)
+            else:
+                results = predict_batch(batch, self.model, topk)
+        except Exception as e:
+            return [(item, e) for item in items]
+        return [(item, (result[:item.topk], {name: outputs[name][i] for name in item.extras}) if item.extras
+                 else result[:item.topk]) for i, (item, result) in enumerate(zip(items, results))]
+
+    def _record(self, items, started):
+        now = time.perf_counter()
+        size = len(items)
+        with self._stats_lock:
+            self._batches += 1
+            self._last_batch_size = size
+            self._batch_sizes[size] = self._batch_sizes.get(size, 0) + 1
+            self._queue_wait_total += sum(started - item.enqueued_at for item in items)
+            self._forward_total += now - started
+        for item in items:
+            STAGE_SECONDS.observe(started - item.enqueued_at, stage="queue_wait")
+
+    def queue_depth(self):
+        with self._cond:
+            return len(self._queue)
+
+    def stats(self):
+        """Snapshot of queue depth and achieved batch sizes for tuning"""
+        depth = self.queue_depth()
+        with self._stats_lock:
+            batched = sum(size * count for size, count in self._batch_sizes.items())
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "queue_depth": depth,
+                "max_queue_depth": self._max_queue_depth,
+                "requests": self._requests,
+                "batches": self._batches,
+                "last_batch_size": self._last_batch_size,
+                "avg_batch_size": batched / self._batches if self._batches else 0.0,
+                "batch_size_histogram": {str(k): v for k, v in sorted(self._batch_sizes.items())},
+                "avg_queue_wait_ms": 1000.0 * self._queue_wait_total / batched if batched else 0.0,
+                "avg_forward_ms": 1000.0 * self._forward_total / self._batches if self._batches else 0.0,
+            }
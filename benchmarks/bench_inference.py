@@ -0,0 +1,187 @@
+"""Latency/throughput benchmark for the inference path, runnable offline.
+
+Uses a randomly initialised ``build_model()`` and synthetic images, so no
+checkpoint is needed. Measures preprocessing, the forward pass across batch
+sizes and thread counts, and end-to-end ``/predict`` through the Flask test
+client, reporting p50/p95/p99 and images/sec as JSON.
+
+    python benchmarks/bench_inference.py --output bench.json
+    python benchmarks/bench_inference.py --output new.json --compare bench.json --threshold 0.10
+
+With ``--compare`` the run exits non-zero if any p50 or p95 regressed by more
+than ``--threshold`` (relative) against the baseline file.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+import torch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import app as webapp  # noqa: E402
+from backends import EagerBackend  # noqa: E402
+from batcher import MicroBatcher  # noqa: E402
+from bench_preprocess import synthetic_scan  # noqa: E402
+from predict import build_model, predict_batch  # noqa: E402
+from preprocess import preprocess  # noqa: E402
+
+
+def summarize(name, params, samples_ms, images_per_call=1):
+    samples = np.asarray(samples_ms)
+    return {
+        "name": name,
+        "params": params,
+        "iterations": len(samples),
+        "mean_ms": float(samples.mean()),
+        "p50_ms": float(np.percentile(samples, 50)),
+        "p95_ms": float(np.percentile(samples, 95)),
+        "p99_ms": float(np.percentile(samples, 99)),
+        "images_per_sec": float(images_per_call * 1000.0 / samples.mean()),
+    }
+
+
+def measure(fn, iterations, warmup):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000.0)
+    return samples
+
+
+def bench_preprocess(images, iterations, warmup):
+    return [summarize("preprocess", {"format": fmt, "size": size},
+                      measure(lambda: preprocess(data), iterations, warmup))
+            for (fmt, size), data in images.items()]
+
+
+def bench_forward(model, batch_sizes, thread_counts, iterations, warmup):
+    results = []
+    for threads in thread_counts:
+        torch.set_num_threads(threads)
+        for n in batch_sizes:
+            batch = torch.randn(n, 3, 224, 224)
+            samples = measure(lambda: predict_batch(batch, model), iterations, warmup)
+            results.append(summarize("forward", {"batch_size": n, "threads": threads}, samples, n))
+    return results
+
+
+def bench_endpoint(images, iterations, warmup):
+    client = webapp.app.test_client()
+    results = []
+    for (fmt, size), data in images.items():
+        filename = "scan." + ("jpg" if fmt == "JPEG" else fmt.lower())
+
+        def call():
+            response = client.post("/predict", data={"image": (io.BytesIO(data), filename)})
+            assert response.status_code == 200, response.get_data(as_text=True)
+
+        results.append(summarize("predict_endpoint", {"format": fmt, "size": size},
+                                 measure(call, iterations, warmup)))
+    return results
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "cpu_capability": torch.backends.cpu.get_cpu_capability(),
+    }
+
+
+def result_key(result):
+    return result["name"], json.dumps(result["params"], sort_keys=True)
+
+
+def compare(current, baseline, threshold):
+    """List of regressions where p50/p95 grew by more than ``threshold`` relative to baseline"""
+    previous = {result_key(r): r for r in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        old = previous.get(result_key(result))
+        if old is None:
+            continue
+        for metric in ("p50_ms", "p95_ms"):
+            change = (result[metric] - old[metric]) / old[metric] if old[metric] else 0.0
+            if change > threshold:
+                regressions.append({"name": result["name"], "params": result["params"], "metric": metric,
+                                    "baseline": old[metric], "current": result[metric], "change": change})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark preprocessing, forward and /predict latency")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[256, 512, 1024])
+    parser.add_argument('--formats', nargs='+', default=['JPEG', 'PNG'])
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--threads', type=int, nargs='+', default=sorted({1, torch.get_num_threads()}))
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write results JSON here (default: stdout)")
+    parser.add_argument('--compare', help="baseline JSON to check for regressions")
+    parser.add_argument('--threshold', type=float, default=0.10, help="allowed relative slowdown")
+    args = parser.parse_args()
+
+    torch.manual_seed(args.seed)
+    model = build_model().eval()
+    images = {(fmt, size): synthetic_scan(size, fmt, args.seed) for fmt in args.formats for size in args.sizes}
+
+    # Wire the Flask app to the random model without the checkpoint/cache machinery
+    webapp.model = model
+    webapp.backend = EagerBackend(model)
+    webapp.batcher = MicroBatcher(webapp.backend, webapp.MAX_BATCH_SIZE, webapp.MAX_BATCH_WAIT_MS)
+    webapp.cache = None
+    webapp.ready = True
+
+    default_threads = torch.get_num_threads()
+    results = bench_preprocess(images, args.iterations, args.warmup)
+    results += bench_forward(webapp.backend, args.batch_sizes, args.threads, args.iterations, args.warmup)
+    torch.set_num_threads(default_threads)
+    results += bench_endpoint(images, args.iterations, args.warmup)
+    report = {"environment": environment(), "config": vars(args), "results": results}
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+    for r in results:
+        print(f"{r['name']:<17} {json.dumps(r['params']):<40} p50 {r['p50_ms']:8.2f}ms  "
+              f"p95 {r['p95_ms']:8.2f}ms  p99 {r['p99_ms']:8.2f}ms  {r['images_per_sec']:8.1f} img/s",
+              file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        for r in regressions:
+            print(f"REGRESSION {r['name']} {json.dumps(r['params'])} {r['metric']}: "
+                  f"{r['baseline']:.2f}ms -> {r['current']:.2f}ms (+{r['change'] * 100:.0f}%)", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.threshold * 100:.0f}% against {args.compare}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
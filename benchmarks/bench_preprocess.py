@@ -0,0 +1,89 @@
+"""Micro-benchmark: reference ``transforms_fn`` pipeline vs the fast path in preprocess.py.
+
+    python benchmarks/bench_preprocess.py --sizes 512 1024 2048 --repeat 20
+
+Reports per-image latency for each path and the max/mean absolute difference
+of the normalized tensors against the reference.
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from predict import transforms_fn  # noqa: E402
+from preprocess import BatchBuffer, preprocess  # noqa: E402
+
+
+def synthetic_scan(size, fmt, seed=0):
+    """Smooth grayscale-ish image with some noise, closer to an MRI slice than pure noise"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size, 0:size] / size
+    base = 128 + 100 * np.sin(6 * x) * np.cos(4 * y)
+    img = np.clip(base[..., None] + rng.normal(0, 8, (size, size, 3)), 0, 255).astype(np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(img).save(buf, fmt, quality=90)
+    return buf.getvalue()
+
+
+def reference(data):
+    return transforms_fn(Image.open(io.BytesIO(data)).convert('RGB'))
+
+
+def time_per_image(fn, data, repeat):
+    fn(data)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(data)
+    return (time.perf_counter() - start) / repeat * 1000.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[512, 1024, 2048])
+    parser.add_argument('--formats', nargs='+', default=['JPEG', 'PNG'])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--batch', type=int, default=16)
+    args = parser.parse_args()
+
+    torch.set_num_threads(1)
+    print(f"{'format':<6} {'size':>5} {'reference':>10} {'fast':>8} {'fast+draft':>11} "
+          f"{'max|d|':>8} {'mean|d|':>8} {'max|d| draft':>12} {'mean|d| draft':>13}")
+    for fmt in args.formats:
+        for size in args.sizes:
+            data = synthetic_scan(size, fmt)
+            ref = reference(data)
+            exact = preprocess(data, draft=False)
+            drafted = preprocess(data, draft=True)
+            diff, diff_draft = (exact - ref).abs(), (drafted - ref).abs()
+            t_ref = time_per_image(reference, data, args.repeat)
+            t_fast = time_per_image(lambda d: preprocess(d, draft=False), data, args.repeat)
+            t_draft = time_per_image(preprocess, data, args.repeat)
+            print(f"{fmt:<6} {size:>5} {t_ref:>8.2f}ms {t_fast:>6.2f}ms {t_draft:>9.2f}ms "
+                  f"{diff.max():>8.1e} {diff.mean():>8.1e} {diff_draft.max():>12.3f} {diff_draft.mean():>13.4f}")
+
+    # Batch assembly: per-image tensors + torch.stack vs filling a preallocated buffer
+    data = synthetic_scan(args.sizes[0], 'JPEG')
+    buffer = BatchBuffer(args.batch)
+
+    def stacked(_):
+        return torch.stack([reference(data) for _ in range(args.batch)])
+
+    def buffered(_):
+        for i in range(args.batch):
+            buffer.fill(i, data)
+        return buffer.view(args.batch)
+
+    t_stack = time_per_image(stacked, None, max(1, args.repeat // 4)) / args.batch
+    t_buffer = time_per_image(buffered, None, max(1, args.repeat // 4)) / args.batch
+    print(f"batch of {args.batch} @ {args.sizes[0]}px JPEG: stack {t_stack:.2f}ms/img, buffer {t_buffer:.2f}ms/img")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+# Content hash first, then fingerprint and suffixes ("-int8-dynamic", "-tta0.9", "-cascade-...+..."):
+# nothing that could leave the cache directory
+SAFE_KEY = re.compile(r"[0-9a-f][0-9A-Za-z._+-]*")
+
+
+def file_stamp(path):
+    """"size:mtime_ns:inode" of a file; replacing it changes this even when the copy keeps an older
+    mtime (rsync -a, cp -p, tar, image layers)"""
+    st = os.stat(path)
+    return f"{st.st_size}:{st.st_mtime_ns}:{st.st_ino}"
+
+
+def fingerprint_file(path, chunk_size=1 << 20):
+    """Short sha256 of a checkpoint file, so cached results are tied to the exact weights.
+
+    Memoized in a ``<path>.sha256`` sidecar (when writable) next to the file's stamp, to keep
+    it off the start-up path; any other stamp means the file was replaced and is hashed again.
+    """
+    sidecar = path + '.sha256'
+    stamp = file_stamp(path)
+    try:
+        with open(sidecar, 'r', encoding='utf-8') as f:
+            recorded = f.read().split()
+        if len(recorded) == 2 and recorded[0] == stamp:
+            return recorded[1]
+    except OSError:
+        pass
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    fingerprint = digest.hexdigest()[:16]
+    try:
+        with open(sidecar, 'w', encoding='utf-8') as f:
+            f.write(f"{stamp} {fingerprint}")
+    except OSError:
+        pass
+    return fingerprint
+
+
+def hash_bytes(data, chunk_size=1 << 20):
+    """sha256 of bytes-like data, or of a stream's contents (an in-memory one's without copying them)"""
+    if hasattr(data, 'getbuffer'):
+        with data.getbuffer() as view:
+            return hashlib.sha256(view).hexdigest()
+    if hasattr(data, 'read'):
+        digest = hashlib.sha256()
+        data.seek(0)
+        for chunk in iter(lambda: data.read(chunk_size), b''):
+            digest.update(chunk)
+        data.seek(0)
+        return digest.hexdigest()
+    return hashlib.sha256(data).hexdigest()
+
+
+class MemoryBackend:
+    """In-process LRU store with a per-entry TTL"""
+
+    def __init__(self, max_entries=10000, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if self.ttl and expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DiskBackend:
+    """One JSON file per entry under ``directory``, shareable between worker processes.
+
+    A file's mtime doubles as its last-access time: hits touch it, the TTL is
+    checked against it and pruning removes the least recently used files first.
+    """
+
+    def __init__(self, directory, max_entries=100000, ttl=86400):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._prune_every = max(1, max_entries // 10)
+        self._writes = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        if not SAFE_KEY.fullmatch(key):
+            raise ValueError(f"Unsafe cache key {key!r}")
+        return os.path.join(self.directory, key[:2], key + '.json')
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            if self.ttl and os.path.getmtime(path) + self.ttl < time.time():
+                os.remove(path)
+                return None
+            with open(path, 'r', encoding='utf-8') as f:
+                value = json.load(f)
+            os.utime(path)
+            return value
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, value):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temp file and rename so concurrent readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(value, f)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        with self._lock:
+            self._writes += 1
+            prune = self._writes % self._prune_every == 0
+        if prune:
+            self.prune()
+
+    def _files(self):
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith('.json'):
+                    yield os.path.join(root, name)
+
+    def prune(self):
+        """Drop expired entries, then the least recently used ones beyond max_entries"""
+        now = time.time()
+        entries = []
+        for path in self._files():
+            try:
+                mtime = os.path.getmtime(path)
+                if self.ttl and mtime + self.ttl < now:
+                    os.remove(path)
+                else:
+                    entries.append((mtime, path))
+            except OSError:
+                continue
+        if len(entries) > self.max_entries:
+            entries.sort()
+            for _, path in entries[:len(entries) - self.max_entries]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def __len__(self):
+        return sum(1 for _ in self._files())
+
+
+class PredictionCache:
+    """Prediction results keyed by image content hash plus model fingerprint"""
+
+    def __init__(self, backend, model_fingerprint):
+        self.backend = backend
+        self.model_fingerprint = model_fingerprint
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, data, model_fingerprint=None):
+        return f"{hash_bytes(data)}-{model_fingerprint or self.model_fingerprint}"
+
+    def get_value(self, key, count=True):
+        """Any JSON-serializable value stored with ``put_value``, or None.
+
+        ``count=False`` leaves the hit rate alone, for entries stored alongside a prediction.
+        """
+        value = self.backend.get(key)
+        if not count:
+            return value
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def put_value(self, key, value):
+        self.backend.put(key, value)
+
+    def get(self, key):
+        return self.get_entry(key)[0]
+
+    def get_entry(self, key):
+        """(results, cascade stage) stored with ``put``; (None, None) on a miss"""
+        value = self.get_value(key)
+        if value is None:
+            return None, None
+        stage = None
+        if isinstance(value, dict):
+            value, stage = value["results"], value.get("stage")
+        return [(label, float(prob)) for label, prob in value], stage
+
+    def put(self, key, results, stage=None):
+        value = [[label, float(prob)] for label, prob in results]
+        self.put_value(key, value if stage is None else {"results": value, "stage": stage})
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "backend": type(self.backend).__name__,
+                "model_fingerprint": self.model_fingerprint,
+                "entries": len(self.backend),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+def create_cache(backend, model_fingerprint, max_entries, ttl, directory):
+    if backend == 'memory':
+        return PredictionCache(MemoryBackend(max_entries, ttl), model_fingerprint)
+    if backend == 'disk':
+        return PredictionCache(DiskBackend(directory, max_entries, ttl), model_fingerprint)
+    if backend in ('', 'none', 'off'):
+        return None
+    raise ValueError(f"Unknown cache backend: {backend}")
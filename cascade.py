@@ -0,0 +1,94 @@
+"""Two-stage cascade: a small screening model answers confident cases, ResNeXt50 the rest.
+
+An image is escalated to the full model when the screening model's top
+probability is below ``threshold`` or its top class is in ``escalate_classes``
+(e.g. "no_tumor" is never accepted from the screening model alone).
+"""
+import threading
+
+import metrics
+from predict import CLASS_NAMES, predict_images
+
+CASCADE_PREDICTIONS = metrics.counter("cascade_predictions_total", "Predictions answered per cascade stage",
+                                      ["stage"])
+CASCADE_ESCALATIONS = metrics.counter("cascade_escalations_total", "Images escalated to the full model",
+                                      ["reason"])
+
+
+class Cascade:
+    def __init__(self, screen, full, threshold=0.95, escalate_classes=("no_tumor",)):
+        # ``screen`` and ``full`` are MicroBatchers; their ``model`` is used for whole batches
+        self.screen = screen
+        self.full = full
+        self.threshold = threshold
+        self.escalate_classes = frozenset(escalate_classes)
+        self._lock = threading.Lock()
+        self._counts = {"screen": 0, "full": 0}
+        self._reasons = {"low_confidence": 0, "class": 0}
+
+    def escalation_reason(self, results):
+        label, prob = results[0]
+        if label in self.escalate_classes:
+            return "class"
+        if prob < self.threshold:
+            return "low_confidence"
+        return None
+
+    def _record(self, stage, reason=None):
+        CASCADE_PREDICTIONS.inc(stage=stage)
+        with self._lock:
+            self._counts[stage] += 1
+            if reason is not None:
+                self._reasons[reason] += 1
+        if reason is not None:
+            CASCADE_ESCALATIONS.inc(reason=reason)
+
+    def predict(self, tensor, topk=1):
+        """Top-k results for a (1, 3, H, W) tensor and the stage ("screen"/"full") that produced them"""
+        results = self.screen.predict(tensor, topk=len(CLASS_NAMES))
+        reason = self.escalation_reason(results)
+        if reason is None:
+            self._record("screen")
+            return results[:topk], "screen"
+        self._record("full", reason)
+        return self.full.predict(tensor, topk=topk), "full"
+
+    def predict_images(self, images, topk=1, batch_size=32):
+        """Cascade over many images: one screening pass, then one full pass over the escalated subset.
+
+        Returns ``(outputs, stages)`` where ``outputs`` matches ``predict_images``.
+        Escalated images are decoded a second time.
+        """
+        outputs = predict_images(images, self.screen.model, len(CLASS_NAMES), batch_size)
+        stages = [None] * len(images)
+        escalated = []
+        for i, (results, error) in enumerate(outputs):
+            if error is not None:
+                continue
+            reason = self.escalation_reason(results)
+            if reason is None:
+                self._record("screen")
+                stages[i] = "screen"
+                outputs[i] = (results[:topk], None)
+            else:
+                self._record("full", reason)
+                stages[i] = "full"
+                escalated.append(i)
+        for i in escalated:
+            if hasattr(images[i], "seek"):
+                images[i].seek(0)
+        full = predict_images([images[i] for i in escalated], self.full.model, topk, batch_size)
+        for i, output in zip(escalated, full):
+            outputs[i] = output
+        return outputs, stages
+
+    def stats(self):
+        with self._lock:
+            total = sum(self._counts.values())
+            return {
+                "threshold": self.threshold,
+                "escalate_classes": sorted(self.escalate_classes),
+                "answered": dict(self._counts),
+                "escalation_reasons": dict(self._reasons),
+                "escalation_rate": self._counts["full"] / total if total else 0.0,
+            }
@@ -0,0 +1,261 @@
+"""Append-only, memory-mapped store of image embeddings with nearest-neighbour search.
+
+One directory per model fingerprint (embeddings of different weights are not
+comparable) holding fixed-width binary columns that only ever grow:
+
+    vectors.f32   N x dim float32, L2-normalized, so dot product = cosine similarity
+    keys.u64      N uint64, first 8 bytes of the image sha256 (duplicate check / lookup)
+    meta.jsonl    one JSON line per row, located through meta.idx (N int64 byte offsets)
+    ivf_centroids.npy / ivf_lists.i32   optional inverted-file (IVF) index
+
+Readers map the files and pick up rows appended by other processes on the next
+search; hash lookups go through an in-memory key -> row dict that catches up
+on those rows by reading only the keys past the last length it saw. Exact search streams the matrix in chunks; the IVF index (spherical
+k-means over a sample) restricts search to the rows of the ``nprobe`` closest
+partitions, for stores with millions of vectors.
+"""
+import contextlib
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: appends are serialized within one process only
+    fcntl = None
+
+EXACT_SEARCH_MAX_ROWS = int(os.environ.get("EXACT_SEARCH_MAX_ROWS", 200000))
+SEARCH_CHUNK_ROWS = 65536
+
+
+def _top(scores, rows, k):
+    """(scores, rows) of the k best entries, best first"""
+    if len(scores) > k:
+        keep = np.argpartition(-scores, k - 1)[:k]
+        scores, rows = scores[keep], rows[keep]
+    order = np.argsort(-scores, kind="stable")
+    return scores[order], rows[order]
+
+
+def key_prefix(image_hash):
+    return int(image_hash[:16], 16)
+
+
+class EmbeddingStore:
+    def __init__(self, directory, dim):
+        self.directory = directory
+        self.dim = dim
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._maps = {}
+        self._centroids = None
+        self._centroids_stamp = None
+        self._index_lock = threading.Lock()
+        self._rows_by_key = {}
+        self._keys_indexed = 0
+        with open(self._path("store.json"), "a+", encoding="utf-8") as f:
+            f.seek(0)
+            info = json.loads(f.read() or "null")
+            if info is None:
+                json.dump({"dim": dim}, f)
+            elif info["dim"] != dim:
+                raise ValueError(f"{directory} holds {info['dim']}-d embeddings, not {dim}-d")
+        with self._append_lock():
+            self._repair()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _rows_in(self, name, row_bytes):
+        try:
+            return os.path.getsize(self._path(name)) // row_bytes
+        except FileNotFoundError:
+            return 0
+
+    def __len__(self):
+        return min(self._rows_in("vectors.f32", 4 * self.dim), self._rows_in("keys.u64", 8),
+                   self._rows_in("meta.idx", 8))
+
+    def _repair(self):
+        # A crash mid-append can leave columns of different lengths; cut them back to the shortest
+        n = len(self)
+        for name, row_bytes in (("vectors.f32", 4 * self.dim), ("keys.u64", 8), ("meta.idx", 8)):
+            path = self._path(name)
+            if os.path.exists(path) and os.path.getsize(path) != n * row_bytes:
+                os.truncate(path, n * row_bytes)
+        if self._rows_in("ivf_lists.i32", 4) > n:
+            os.truncate(self._path("ivf_lists.i32"), n * 4)
+
+    @contextlib.contextmanager
+    def _append_lock(self):
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self._path(".lock"), "w") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _map(self, name, dtype, n, width=None):
+        """Read-only memmap of the first ``n`` rows of a column, remapped when the file has grown"""
+        cached = self._maps.get(name)
+        if cached is None or len(cached) < n:
+            shape = (n, width) if width else (n,)
+            cached = np.memmap(self._path(name), dtype=dtype, mode="r", shape=shape) if n else np.zeros(shape, dtype)
+            self._maps[name] = cached
+        return cached[:n]
+
+    def vectors(self, n=None):
+        return self._map("vectors.f32", np.float32, len(self) if n is None else n, self.dim)
+
+    def keys(self, n=None):
+        return self._map("keys.u64", np.uint64, len(self) if n is None else n)
+
+    def find(self, image_hash):
+        """Row of the first embedding stored for an image hash, or None"""
+        n = len(self)
+        with self._index_lock:
+            if n > self._keys_indexed:
+                for row, key in enumerate(self.keys(n)[self._keys_indexed:].tolist(), self._keys_indexed):
+                    self._rows_by_key.setdefault(key, row)
+                self._keys_indexed = n
+            return self._rows_by_key.get(key_prefix(image_hash))
+
+    def vector(self, row):
+        return np.array(self.vectors(row + 1)[row])
+
+    def metadata(self, rows):
+        offsets = self._map("meta.idx", np.int64, len(self))
+        out = []
+        with open(self._path("meta.jsonl"), "rb") as f:
+            for row in rows:
+                f.seek(int(offsets[row]))
+                out.append(json.loads(f.readline()))
+        return out
+
+    def add(self, image_hash, embedding, metadata=None):
+        """Append one embedding unless this image is already stored; returns its row"""
+        vector = np.asarray(embedding, dtype=np.float32).reshape(self.dim)
+        vector = vector / max(float(np.linalg.norm(vector)), 1e-12)
+        record = dict(metadata or {}, hash=image_hash, added=time.time())
+        with self._append_lock():
+            existing = self.find(image_hash)
+            if existing is not None:
+                return existing
+            row = len(self)
+            with open(self._path("meta.jsonl"), "ab") as f:
+                offset = f.tell()
+                f.write(json.dumps(record).encode("utf-8") + b"\n")
+            centroids = self._load_centroids()
+            if centroids is not None:
+                with open(self._path("ivf_lists.i32"), "ab") as f:
+                    f.write(np.int32(np.argmax(centroids @ vector)).tobytes())
+            with open(self._path("vectors.f32"), "ab") as f:
+                f.write(vector.tobytes())
+            with open(self._path("keys.u64"), "ab") as f:
+                f.write(np.uint64(key_prefix(image_hash)).tobytes())
+            # meta.idx last: a row exists once all its columns do
+            with open(self._path("meta.idx"), "ab") as f:
+                f.write(np.int64(offset).tobytes())
+            with self._index_lock:
+                if self._keys_indexed == row:
+                    self._rows_by_key.setdefault(key_prefix(image_hash), row)
+                    self._keys_indexed = row + 1
+        return row
+
+    def _load_centroids(self):
+        path = self._path("ivf_centroids.npy")
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            if self._centroids is not None:
+                self._maps.pop("ivf_lists.i32", None)
+            self._centroids = self._centroids_stamp = None
+            return None
+        stamp = (st.st_mtime_ns, st.st_ino, st.st_size)
+        if stamp != self._centroids_stamp:
+            # A rebuilt index replaces both files: drop the old list assignments with the old centroids
+            self._maps.pop("ivf_lists.i32", None)
+            self._centroids, self._centroids_stamp = np.load(path), stamp
+        return self._centroids
+
+    def build_index(self, lists=None, sample=100000, iterations=10, seed=0):
+        """Partition the store with spherical k-means; rows added later are assigned on append"""
+        with self._append_lock():
+            n = len(self)
+            if n == 0:
+                raise ValueError("Cannot index an empty store")
+            lists = min(n, lists or max(1, int(4 * np.sqrt(n))))
+            vectors = self.vectors(n)
+            rng = np.random.default_rng(seed)
+            train = np.asarray(vectors[np.sort(rng.choice(n, min(n, max(sample, lists)), replace=False))])
+            centroids = train[rng.choice(len(train), lists, replace=False)].copy()
+            for _ in range(iterations):
+                assign = np.argmax(train @ centroids.T, axis=1)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, assign, train)
+                norms = np.linalg.norm(sums, axis=1, keepdims=True)
+                empty = norms[:, 0] == 0
+                centroids = np.where(empty[:, None], centroids, sums / np.maximum(norms, 1e-12))
+            assign = np.concatenate([np.argmax(vectors[i:i + SEARCH_CHUNK_ROWS] @ centroids.T, axis=1)
+                                     for i in range(0, n, SEARCH_CHUNK_ROWS)]).astype(np.int32)
+            tmp = self._path("ivf_lists.i32.tmp")
+            assign.tofile(tmp)
+            os.replace(tmp, self._path("ivf_lists.i32"))
+            np.save(self._path("ivf_centroids.tmp.npy"), centroids.astype(np.float32))
+            os.replace(self._path("ivf_centroids.tmp.npy"), self._path("ivf_centroids.npy"))
+            self._maps.pop("ivf_lists.i32", None)
+        return {"rows": n, "lists": lists}
+
+    def search(self, query, k=10, mode="auto", nprobe=8):
+        """Nearest stored rows to ``query`` by cosine similarity: list of (row, score), best first.
+
+        ``mode`` is "exact", "ivf" or "auto" (exact up to EXACT_SEARCH_MAX_ROWS rows
+        or while no index exists).
+        """
+        query = np.asarray(query, dtype=np.float32).reshape(self.dim)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        n = len(self)
+        if n == 0:
+            return []
+        centroids = self._load_centroids()
+        if mode == "auto":
+            mode = "ivf" if centroids is not None and n > EXACT_SEARCH_MAX_ROWS else "exact"
+        if mode == "ivf":
+            if centroids is None:
+                raise ValueError("No IVF index has been built for this store")
+            indexed = min(n, self._rows_in("ivf_lists.i32", 4))
+            probe = np.argsort(-(centroids @ query))[:nprobe]
+            rows = np.flatnonzero(np.isin(self._map("ivf_lists.i32", np.int32, indexed), probe))
+            # Rows appended by another process since this one last looked are searched exactly
+            rows = np.concatenate([rows, np.arange(indexed, n)])
+        else:
+            rows = None
+        vectors = self.vectors(n)
+        best_scores, best_rows = np.empty(0, np.float32), np.empty(0, np.int64)
+        total = n if rows is None else len(rows)
+        for start in range(0, total, SEARCH_CHUNK_ROWS):
+            if rows is None:
+                chunk_rows = np.arange(start, min(start + SEARCH_CHUNK_ROWS, n))
+                scores = vectors[start:start + SEARCH_CHUNK_ROWS] @ query
+            else:
+                chunk_rows = rows[start:start + SEARCH_CHUNK_ROWS]
+                scores = vectors[chunk_rows] @ query
+            best_scores, best_rows = _top(np.concatenate([best_scores, scores]),
+                                          np.concatenate([best_rows, chunk_rows]), k)
+        return [(int(row), float(score)) for row, score in zip(best_rows, best_scores)]
+
+    def stats(self):
+        centroids = self._load_centroids()
+        return {
+            "rows": len(self),
+            "dim": self.dim,
+            "index_lists": None if centroids is None else len(centroids),
+            "indexed_rows": self._rows_in("ivf_lists.i32", 4) if centroids is not None else 0,
+        }
@@ -0,0 +1,113 @@
+"""Web UI assets, built once at start-up and served from memory.
+
+``static/`` is the only copy of the page. At build time every asset referenced
+from index.html as ``/static/<name>`` gets a content-fingerprinted URL
+(``/static/app.3f2a9c1d0b7e.js``) that is cached for a year as immutable, while
+the page itself is revalidated on each load. Every asset is stored plain,
+gzip- and (when the brotli package is installed) brotli-compressed with a
+strong ETag per encoding, so a request is a dict lookup plus header checks.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+STATIC_PREFIX = "/static/"
+# Only bother compressing assets that are at least this large
+MIN_COMPRESS_BYTES = 256
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+TEXT_TYPES = {".html": "text/html; charset=utf-8", ".css": "text/css; charset=utf-8",
+              ".js": "text/javascript; charset=utf-8"}
+
+
+class Asset:
+    def __init__(self, body, content_type, cache_control):
+        self.content_type = content_type
+        self.cache_control = cache_control
+        digest = hashlib.sha256(body).hexdigest()[:16]
+        # encoding -> (bytes, ETag); "identity" is always present
+        self.variants = {"identity": (body, f'"{digest}"')}
+        if len(body) >= MIN_COMPRESS_BYTES:
+            compressed = gzip.compress(body, 9, mtime=0)
+            if len(compressed) < len(body):
+                self.variants["gzip"] = (compressed, f'"{digest}-gz"')
+            if brotli is not None:
+                compressed = brotli.compress(body, quality=11)
+                if len(compressed) < len(body):
+                    self.variants["br"] = (compressed, f'"{digest}-br"')
+
+    def choose(self, accept_encoding):
+        """The smallest variant the client accepts (q=0 excluded); identity as a fallback"""
+        accepted = set()
+        for part in (accept_encoding or "").lower().split(","):
+            coding, _, params = part.strip().partition(";")
+            params = params.replace(" ", "")
+            try:
+                weight = float(params[2:]) if params.startswith("q=") else 1.0
+            except ValueError:
+                weight = 1.0
+            if coding and weight > 0:
+                accepted.add(coding)
+        options = [e for e in self.variants if e != "identity" and (e in accepted or "*" in accepted)]
+        return min(options, key=lambda e: len(self.variants[e][0]), default="identity")
+
+
+def _fingerprinted(name, body):
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{hashlib.sha256(body).hexdigest()[:12]}{ext}"
+
+
+def build(static_dir=STATIC_DIR):
+    """URL path -> Asset for every file under ``static_dir``, with index.html also at "/" """
+    files = {}
+    for root, _, names in os.walk(static_dir):
+        for name in names:
+            path = os.path.join(root, name)
+            with open(path, "rb") as f:
+                files[os.path.relpath(path, static_dir).replace(os.sep, "/")] = f.read()
+    page = files.pop("index.html", None)
+    assets = {}
+    for name, body in files.items():
+        content_type = (TEXT_TYPES.get(os.path.splitext(name)[1]) or mimetypes.guess_type(name)[0]
+                        or "application/octet-stream")
+        fingerprinted = _fingerprinted(name, body)
+        assets[STATIC_PREFIX + fingerprinted] = Asset(body, content_type, IMMUTABLE)
+        # The plain name keeps working (bookmarks, old pages) but is revalidated
+        assets[STATIC_PREFIX + name] = Asset(body, content_type, REVALIDATE)
+        if page is not None:
+            page = page.replace(f'"{STATIC_PREFIX}{name}"'.encode(), f'"{STATIC_PREFIX}{fingerprinted}"'.encode())
+    if page is not None:
+        assets["/"] = assets[STATIC_PREFIX + "index.html"] = Asset(page, TEXT_TYPES[".html"], REVALIDATE)
+    return assets
+
+
+def _etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses weak comparison
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+def respond(asset, accept_encoding=None, if_none_match=None, head=False):
+    """(status, headers, body) for serving ``asset`` to a request with these headers"""
+    encoding = asset.choose(accept_encoding)
+    body, etag = asset.variants[encoding]
+    headers = [("ETag", etag), ("Cache-Control", asset.cache_control)]
+    if len(asset.variants) > 1:
+        headers.append(("Vary", "Accept-Encoding"))
+    if _etag_matches(if_none_match, etag):
+        return 304, headers, b""
+    headers.append(("Content-Type", asset.content_type))
+    if encoding != "identity":
+        headers.append(("Content-Encoding", encoding))
+    headers.append(("Content-Length", str(len(body))))
+    return 200, headers, b"" if head else body
@@ -0,0 +1,295 @@
+"""Asynchronous prediction jobs: submit many images, stream per-image results as they finish.
+
+Images of every submitted job wait in one shared queue. Worker threads take up
+to ``batch_size`` of them at a time, across jobs that share a route (model,
+version, top-k), and classify them in one batched call. Each finished image is
+appended to its job's event log, which ``/jobs/<id>/events`` replays and then
+follows as Server-Sent Events. Jobs live in a bounded store and expire ``ttl``
+seconds after they finish; uploaded bytes are dropped as soon as an image is done.
+
+With a ``directory`` (several server processes) each job also writes its events
+to ``<directory>/<id>.jsonl``. The process that accepted a job keeps processing
+it; any other process answers status and event requests for it by following
+that file.
+"""
+import collections
+import json
+import os
+import re
+import threading
+import time
+import uuid
+
+import metrics
+
+JOBS = metrics.counter("jobs_total", "Finished jobs by outcome", ["status"])
+JOB_ID = re.compile(r"[0-9a-f]{32}")
+# How often a job followed from another process's log is checked for new events
+FOLLOW_POLL_SECONDS = 0.2
+
+
+class Job:
+    def __init__(self, job_id, route, filenames, log_path=None):
+        self.id = job_id
+        self.route = route
+        self.filenames = filenames
+        self.total = len(filenames)
+        self.results = [None] * self.total
+        self.completed = 0
+        self.failed = 0
+        self.status = "queued"
+        self.created = time.time()
+        self.finished = None
+        # (event name, payload) in the order they happened; SSE ids are indexes into this list
+        self.events = []
+        self.cond = threading.Condition()
+        # Owner: where events are appended; follower (see ``follow``): read position in the owner's log
+        self.log_path = log_path
+        self.following = None
+        self._offset = 0
+        if log_path is not None:
+            with open(log_path, "w", encoding="utf-8") as f:
+                f.write(json.dumps({"job": job_id, "filenames": filenames, "created": self.created}) + "\n")
+
+    @classmethod
+    def follow(cls, path):
+        """Read-only view of a job owned by another process, kept current from its event log"""
+        with open(path, "rb") as f:
+            header = json.loads(f.readline())
+            offset = f.tell()
+        job = cls(header["job"], None, header["filenames"])
+        job.created = header["created"]
+        job.following, job._offset = path, offset
+        job._catch_up()
+        return job
+
+    def _catch_up(self):
+        # Called with self.cond held (or before the job is shared); only complete lines are applied
+        with open(self.following, "rb") as f:
+            f.seek(self._offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1
+        self._offset += end
+        for line in data[:end].splitlines():
+            record = json.loads(line)
+            name, payload = record["event"], record["data"]
+            if name == "result":
+                entry = {k: v for k, v in payload.items() if k not in ("index", "completed", "total")}
+                self.results[payload["index"]] = entry
+                self.completed = payload["completed"]
+                self.failed += entry["status"] == "error"
+                self.status = "running"
+            elif name == "done":
+                self.status, self.finished = "done", record["time"]
+            self.events.append((name, payload))
+
+    def _event(self, name, payload):
+        self.events.append((name, payload))
+        if self.log_path is not None:
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"event": name, "data": payload, "time": time.time()}) + "\n")
+
+    @property
+    def done(self):
+        return self.completed == self.total
+
+    def record(self, index, entry):
+        with self.cond:
+            if self.results[index] is not None:
+                return
+            self.results[index] = entry
+            self.completed += 1
+            self.failed += entry["status"] == "error"
+            self.status = "running"
+            self._event("result", dict(entry, index=index, completed=self.completed, total=self.total))
+            if self.done:
+                self._finish()
+            self.cond.notify_all()
+
+    def _finish(self):
+        self.status = "done"
+        self.finished = time.time()
+        self._event("done", self.summary())
+        JOBS.inc(status="failed" if self.failed == self.total else "done")
+
+    def summary(self):
+        return {"job_id": self.id, "status": self.status, "completed": self.completed, "failed": self.failed,
+                "total": self.total}
+
+    def info(self):
+        with self.cond:
+            if self.following is not None:
+                self._catch_up()
+            return dict(self.summary(), created=self.created, finished=self.finished,
+                        results=[entry or {"filename": name, "status": "pending"}
+                                 for name, entry in zip(self.filenames, self.results)])
+
+    def events_since(self, cursor, timeout):
+        """Events from index ``cursor`` on, waiting up to ``timeout`` for one; and whether the job is done"""
+        if self.following is not None:
+            deadline = time.monotonic() + timeout
+            while True:
+                with self.cond:
+                    self._catch_up()
+                    if cursor < len(self.events) or self.done or time.monotonic() >= deadline:
+                        return self.events[cursor:], self.done
+                time.sleep(FOLLOW_POLL_SECONDS)
+        with self.cond:
+            if cursor >= len(self.events) and not self.done:
+                self.cond.wait(timeout)
+            return self.events[cursor:], self.done
+
+
+class JobQueue:
+    def __init__(self, process, workers=1, batch_size=32, max_jobs=1000, ttl=3600, max_queued=10000,
+                 directory=None):
+        # process(route, [(filename, image)]) -> one result entry per image, each with a "status"
+        self.process = process
+        self.directory = None
+        if directory:
+            self.use_directory(directory)
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_jobs = max_jobs
+        self.ttl = ttl
+        self.max_queued = max_queued
+        self._jobs = collections.OrderedDict()
+        self._pending = collections.deque()
+        self._cond = threading.Condition()
+        self._threads = []
+        self.batches = 0
+        self.images = 0
+        self._swept = 0.0
+
+    def use_directory(self, directory):
+        """Share jobs with other processes through event logs in ``directory``"""
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+
+    def _path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.jsonl")
+
+    def _start(self):
+        # Called with self._cond held; workers are started by the first submission
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work, name=f"job-worker-{len(self._threads)}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _expire(self):
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if job.finished is not None and now - job.finished > self.ttl:
+                self._drop(job_id)
+        # Over capacity: drop the oldest finished jobs first
+        for job_id, job in list(self._jobs.items()):
+            if len(self._jobs) < self.max_jobs:
+                break
+            if job.finished is not None:
+                self._drop(job_id)
+        # Logs left behind by other (possibly restarted) processes; a log is touched on every event
+        if self.directory is not None and now - self._swept > min(60.0, self.ttl):
+            self._swept = now
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                try:
+                    if name.endswith(".jsonl") and now - os.path.getmtime(path) > self.ttl:
+                        os.remove(path)
+                except OSError:
+                    pass
+
+    def _drop(self, job_id):
+        del self._jobs[job_id]
+        if self.directory is not None:
+            try:
+                os.remove(self._path(job_id))
+            except OSError:
+                pass
+
+    def submit(self, items, route=None):
+        """Queue (filename, image or error entry) pairs as a new job; None when the store or queue is full.
+
+        Items whose value is a dict are recorded as finished entries straight away.
+        """
+        queued = sum(1 for _, image in items if not isinstance(image, dict))
+        with self._cond:
+            self._expire()
+            if len(self._jobs) >= self.max_jobs or len(self._pending) + queued > self.max_queued:
+                return None
+            job_id = uuid.uuid4().hex
+            job = Job(job_id, route, [name for name, _ in items],
+                      self._path(job_id) if self.directory is not None else None)
+            self._jobs[job.id] = job
+            for index, (name, image) in enumerate(items):
+                if isinstance(image, dict):
+                    job.record(index, image)
+                else:
+                    self._pending.append((job, index, name, image))
+            if not items:
+                with job.cond:
+                    job._finish()
+            self._start()
+            self._cond.notify_all()
+        return job
+
+    def get(self, job_id):
+        with self._cond:
+            self._expire()
+            job = self._jobs.get(job_id)
+        if job is None and self.directory is not None and JOB_ID.fullmatch(job_id):
+            try:
+                job = Job.follow(self._path(job_id))
+            except (OSError, ValueError, KeyError):
+                return None
+            if job.finished is not None and time.time() - job.finished > self.ttl:
+                return None
+        return job
+
+    def _take(self):
+        """Up to ``batch_size`` queued images sharing the route of the oldest one"""
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            route = self._pending[0][0].route
+            batch, rest = [], collections.deque()
+            while self._pending:
+                item = self._pending.popleft()
+                if len(batch) < self.batch_size and item[0].route == route:
+                    batch.append(item)
+                else:
+                    rest.append(item)
+            self._pending = rest
+            return route, batch
+
+    def _work(self):
+        while True:
+            route, batch = self._take()
+            try:
+                entries = self.process(route, [(name, image) for _, _, name, image in batch])
+            except Exception as e:
+                entries = [{"filename": name, "error": f"Prediction failed: {e}", "status": "error"}
+                           for _, _, name, _ in batch]
+            for (job, index, _, _), entry in zip(batch, entries):
+                job.record(index, entry)
+            self.batches += 1
+            self.images += len(batch)
+
+    def queue_depth(self):
+        return len(self._pending)
+
+    def stats(self):
+        with self._cond:
+            jobs = list(self._jobs.values())
+            return {
+                "jobs": len(jobs),
+                "running": sum(1 for job in jobs if not job.done),
+                "queued_images": len(self._pending),
+                "max_jobs": self.max_jobs,
+                "max_queued_images": self.max_queued,
+                "ttl_seconds": self.ttl,
+                "workers": self.workers,
+                "batch_size": self.batch_size,
+                "batches": self.batches,
+                "images": self.images,
+                "mean_batch_size": self.images / self.batches if self.batches else 0.0,
+            }
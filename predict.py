@@ -1,11 +1,27 @@
 import torch
 from torchvision import models, transforms
-from PIL import Image
+import contextlib
 import os
+import threading
+from metrics import BATCH_SIZE, IMAGE_HEIGHT, IMAGE_WIDTH, STAGE_SECONDS
+from preprocess import IMAGE_SIZE, MEAN, STD, decode, normalize_into, open_image, thread_buffer
+from weights import load_state_dict
 
 CLASS_NAMES = ["glioma", "meningioma", "no_tumor", "pituitary"]
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+# Execution mode: NHWC (channels_last) weights/inputs under inference_mode, optionally with
+# CPU BF16 autocast (AVX-512 BF16 / AMX hosts). Default is contiguous NCHW FP32 under no_grad.
+CHANNELS_LAST = os.environ.get("CHANNELS_LAST", "0") == "1"
+BF16_AUTOCAST = os.environ.get("BF16_AUTOCAST", "0") == "1"
+# Test-time augmentation views (see tta_views), added to the plain prediction
+TTA_VIEWS = ("hflip", "center_crop", "center_crop_hflip", "zoom_out", "zoom_out_hflip")
+TTA_CROP = 0.875
+# torchvision ResNet/ResNeXt modules up to the last stage, in forward order
+RESNET_TRUNK = ("conv1", "bn1", "relu", "maxpool", "layer1", "layer2", "layer3", "layer4")
+# Penultimate (pooled) features seen by the classifier head during the current thread's forward
+_features = threading.local()
 
+# Reference PIL/torchvision pipeline; load_image uses the equivalent fast path in preprocess.py
 transforms_fn = transforms.Compose([
     transforms.Resize((224, 224)),
     transforms.ToTensor(),
@@ -13,37 +29,270 @@ transforms_fn = transforms.Compose([
                          [0.229, 0.224, 0.225])
 ])
 
-def load_image(path):
-    img = Image.open(path).convert('RGB')
-    img = transforms_fn(img)
-    return img.unsqueeze(0)
+def decode_image(image):
+    """Open and resize an input to a 224x224 RGB PIL image, recording its source dimensions"""
+    with STAGE_SECONDS.time(stage="decode"):
+        img = open_image(image)
+        IMAGE_WIDTH.observe(img.width)
+        IMAGE_HEIGHT.observe(img.height)
+        return decode(img)
 
-def build_model(num_classes=len(CLASS_NAMES)):
-    model = models.resnext50_32x4d(weights=None)
-    in_features = model.fc.in_features
-    model.fc = torch.nn.Sequential(
-        torch.nn.Dropout(p=0.5),
-        torch.nn.Linear(in_features, num_classes)
-    )
-    return model.to(device)
+def load_image(image):
+    # Tensors are taken as already transformed, either (3, H, W) or (N, 3, H, W)
+    if isinstance(image, torch.Tensor):
+        return image if image.dim() == 4 else image.unsqueeze(0)
+    img = decode_image(image)
+    with STAGE_SECONDS.time(stage="transform"):
+        tensor = normalize_into(img, torch.empty((3,) + IMAGE_SIZE))
+    return tensor.unsqueeze(0)
+
+def build_model(num_classes=len(CLASS_NAMES), empty=False, arch="resnext50_32x4d"):
+    # empty=True builds on the meta device, skipping random init; load_checkpoint must follow.
+    # ``arch`` is any torchvision classifier; ResNet-family heads get the same Dropout+Linear
+    # as the ResNeXt50 checkpoint, MobileNet/EfficientNet-style ones a new final Linear.
+    with torch.device("meta") if empty else contextlib.nullcontext():
+        model = getattr(models, arch)(weights=None)
+        if hasattr(model, "fc"):
+            in_features = model.fc.in_features
+            model.fc = torch.nn.Sequential(
+                torch.nn.Dropout(p=0.5),
+                torch.nn.Linear(in_features, num_classes)
+            )
+        else:
+            model.classifier[-1] = torch.nn.Linear(model.classifier[-1].in_features, num_classes)
+    return model if empty else model.to(device)
 
 def load_checkpoint(model, path):
     if not os.path.exists(path):
         raise FileNotFoundError(f"Model file not found at {path}")
-    state = torch.load(path, map_location=device)
-    state_dict = state.get("model_state_dict", state) if isinstance(state, dict) else state
-    new_state = {k.replace("module.", "") if k.startswith("module.") else k: v for k, v in state_dict.items()}
-    model.load_state_dict(new_state, strict=True)
+    state_dict = load_state_dict(path)
+    # Meta-device models adopt the memory-mapped tensors instead of copying into fresh storage
+    assign = any(p.is_meta for p in model.parameters())
+    model.load_state_dict(state_dict, strict=True, assign=assign)
+    model.to(device)
     model.eval()
     return model
 
-def predict_image(image_path, model, topk=1):
-    input_tensor = load_image(image_path).to(device)
+def prepare_model(model):
+    """Convert a loaded model to the configured memory format"""
+    if CHANNELS_LAST:
+        model = model.to(memory_format=torch.channels_last)
+    return model
+
+def prepare_input(input_batch):
+    if CHANNELS_LAST:
+        return input_batch.to(device, memory_format=torch.channels_last)
+    return input_batch.to(device)
+
+def inference_context():
+    """Grad-free context for the configured execution mode"""
+    if not (CHANNELS_LAST or BF16_AUTOCAST):
+        return torch.no_grad()
+    stack = contextlib.ExitStack()
+    stack.enter_context(torch.inference_mode())
+    if BF16_AUTOCAST:
+        stack.enter_context(torch.autocast(device.type, dtype=torch.bfloat16))
+    return stack
+
+def verify_execution_mode(model, reference_model, batch_size=2, rtol=None):
+    """Compare logits in the configured mode against contiguous FP32 ``reference_model``.
+
+    Returns the max absolute logit difference; raises if it exceeds ``rtol`` times the
+    largest reference logit (default 5e-2 with BF16 autocast, 1e-4 otherwise).
+    """
+    if rtol is None:
+        rtol = 5e-2 if BF16_AUTOCAST else 1e-4
+    torch.manual_seed(0)
+    input_batch = torch.randn(batch_size, 3, 224, 224, device=device)
     with torch.no_grad():
-        outputs = model(input_tensor)
-        probs = torch.nn.functional.softmax(outputs, dim=1)
+        expected = reference_model(input_batch).float()
+    with inference_context():
+        actual = model(prepare_input(input_batch)).float()
+    diff = (actual - expected).abs().max().item()
+    limit = rtol * expected.abs().max().item()
+    if not diff <= limit:
+        raise RuntimeError(f"Execution mode logits differ from FP32: max |diff| = {diff:.3e} > {limit:.3e}")
+    return diff
+
+def _capture_head_input(module, args):
+    _features.value = args[0]
+
+def feature_head(model):
+    """The ``fc`` head of an eager model (or backend wrapping one), hooked to keep its input features"""
+    module = getattr(model, "model", model)
+    # An FX-converted (statically quantized) graph calls the head's children directly, so a hook on fc never fires
+    eager = isinstance(module, torch.nn.Module) and not isinstance(module, torch.fx.GraphModule)
+    head = dict(module.named_modules()).get("fc") if eager else None
+    if head is None:
+        raise ValueError("Embeddings need an eager model with an fc head")
+    if not getattr(head, "_captures_features", False):
+        head.register_forward_pre_hook(_capture_head_input)
+        head._captures_features = True
+    return head
+
+def predict_probs(input_batch, model, features=False):
+    """One forward over a stacked (N, 3, H, W) batch; returns (N, classes) FP32 softmax.
+
+    With ``features=True`` also returns the (N, D) pooled features the head saw in
+    that same forward, e.g. the 2048-d ResNeXt50 embedding.
+    """
+    if features:
+        feature_head(model)
+    BATCH_SIZE.observe(len(input_batch))
+    input_batch = prepare_input(input_batch)
+    with STAGE_SECONDS.time(stage="forward"), inference_context():
+        outputs = model(input_batch)
+    probs = torch.nn.functional.softmax(outputs.float(), dim=1)
+    if not features:
+        return probs
+    embeddings, _features.value = getattr(_features, "value", None), None
+    if embeddings is None:
+        raise ValueError("The model's forward did not pass through its fc head; no embeddings captured")
+    if embeddings.is_quantized:
+        embeddings = embeddings.dequantize()
+    return probs, embeddings.float()
+
+def predict_batch(input_batch, model, topk=1, features=False):
+    """Run one forward over a stacked (N, 3, H, W) batch and return top-k results per image.
+
+    With ``features=True`` returns ``(results, embeddings)``, embeddings as an (N, D) float32 array.
+    """
+    probs = predict_probs(input_batch, model, features)
+    if features:
+        probs, embeddings = probs
+    results = _topk_results(probs, topk)
+    return (results, embeddings.cpu().numpy()) if features else results
+
+def _topk_results(probs, topk):
+    with STAGE_SECONDS.time(stage="postprocess"):
         top_probs, top_idx = probs.topk(topk, dim=1)
-    top_probs = top_probs.cpu().numpy()[0]
-    top_idx = top_idx.cpu().numpy()[0]
-    results = [(CLASS_NAMES[idx], float(prob)) for idx, prob in zip(top_idx, top_probs)]
-    return results
+        top_probs = top_probs.cpu().numpy()
+        top_idx = top_idx.cpu().numpy()
+        return [[(CLASS_NAMES[idx], float(prob)) for idx, prob in zip(row_idx, row_probs)]
+                for row_idx, row_probs in zip(top_idx, top_probs)]
+
+def grad_cam_model(model):
+    """The eager ResNet-style module behind ``model`` (a backend or module), as explain_batch needs it"""
+    module = getattr(model, "model", model)
+    if not all(isinstance(getattr(module, name, None), torch.nn.Module) for name in RESNET_TRUNK + ("fc",)):
+        raise ValueError("Explanations need an eager ResNet-style model")
+    # Grad-CAM backpropagates through pooling and the head; quantized modules have no autograd
+    head = list(module.avgpool.modules()) + list(module.fc.modules())
+    if any(".quantized" in type(m).__module__ for m in head):
+        raise ValueError("Explanations need a float (non-quantized) classifier head")
+    return module
+
+def explain_batch(input_batch, model, topk=1):
+    """Classify a batch and compute Grad-CAM for each image's top class in the same pass.
+
+    The trunk runs once in the normal grad-free mode; only pooling and the head are
+    replayed with autograd on a copy of the last stage's activations, so the backward
+    is a few small ops rather than a full pass. Returns ``(results, embeddings,
+    heatmaps)``: top-k lists, (N, D) pooled features and (N, h, w) maps in [0, 1]
+    at the last stage's resolution (7x7 for 224x224 inputs).
+    """
+    module = grad_cam_model(model)
+    BATCH_SIZE.observe(len(input_batch))
+    x = prepare_input(input_batch)
+    with STAGE_SECONDS.time(stage="forward"):
+        with inference_context():
+            for name in RESNET_TRUNK:
+                x = getattr(module, name)(x)
+        activations = x.float().clone().requires_grad_()
+        with torch.enable_grad():
+            embeddings = torch.flatten(module.avgpool(activations), 1)
+            logits = module.fc(embeddings)
+            top = logits.argmax(dim=1, keepdim=True)
+            grads, = torch.autograd.grad(logits.gather(1, top).sum(), activations)
+        _features.value = None
+    with STAGE_SECONDS.time(stage="explain"):
+        weights = grads.mean(dim=(2, 3), keepdim=True)
+        heatmaps = torch.relu((weights * activations.detach()).sum(dim=1))
+        heatmaps = heatmaps / heatmaps.flatten(1).amax(dim=1).clamp_min(1e-12).view(-1, 1, 1)
+    probs = torch.nn.functional.softmax(logits.detach(), dim=1)
+    return _topk_results(probs, topk), embeddings.detach().cpu().numpy(), heatmaps.cpu().numpy()
+
+def predict_image(image, model, topk=1):
+    return predict_batch(load_image(image), model, topk)[0]
+
+def tta_views(tensor, views=TTA_VIEWS):
+    """Stack augmented copies of a normalized (3, H, W) tensor into one (len(views), 3, H, W) batch.
+
+    Crops are upsampled back to full size; zoom-out shrinks the image and pads it
+    with the normalized value of black, which is what the scan background is.
+    """
+    _, height, width = tensor.shape
+    crop_h, crop_w = round(height * TTA_CROP), round(width * TTA_CROP)
+    top, left = (height - crop_h) // 2, (width - crop_w) // 2
+    resize = lambda t, size: torch.nn.functional.interpolate(
+        t.unsqueeze(0), size=size, mode="bilinear", align_corners=False)[0]
+    cropped = resize(tensor[:, top:top + crop_h, left:left + crop_w], (height, width))
+    zoomed = torch.tensor([-m / s for m, s in zip(MEAN, STD)]).view(3, 1, 1).repeat(1, height, width)
+    zoomed[:, top:top + crop_h, left:left + crop_w] = resize(tensor, (crop_h, crop_w))
+    base = {"center_crop": cropped, "zoom_out": zoomed}
+    batch = []
+    for view in views:
+        name, flip = (view[:-len("_hflip")], True) if view.endswith("_hflip") else (view, view == "hflip")
+        image = tensor if name == "hflip" else base[name]
+        batch.append(image.flip(-1) if flip else image)
+    return torch.stack(batch)
+
+def predict_tta(image, model, threshold=1.0, plain=None, views=TTA_VIEWS):
+    """Test-time augmentation with every view in a single forward pass.
+
+    ``plain`` may carry an already computed (label, probability) list for the
+    unaugmented image (e.g. from the micro-batcher or cache); otherwise it is
+    computed here. If its top probability is at least ``threshold`` no views
+    are run. Returns the averaged probabilities plus each view's own.
+    """
+    input_batch = load_image(image)
+    if plain is None:
+        plain_probs = predict_probs(input_batch[:1], model)[0]
+    else:
+        plain_probs = torch.tensor([dict(plain)[name] for name in CLASS_NAMES])
+    probs = [plain_probs]
+    applied = plain_probs.max().item() < threshold
+    if applied:
+        probs.extend(predict_probs(tta_views(input_batch[0], views), model))
+    mean = torch.stack(probs).mean(dim=0)
+    as_dict = lambda p: {name: float(v) for name, v in zip(CLASS_NAMES, p.tolist())}
+    return {
+        "applied": applied,
+        "prediction": CLASS_NAMES[int(mean.argmax())],
+        "confidence": float(mean.max()),
+        "probabilities": as_dict(mean),
+        "views": [{"view": view, "probabilities": as_dict(p)}
+                  for view, p in zip(("original",) + tuple(views if applied else ()), probs)],
+    }
+
+def predict_images(images, model, topk=1, batch_size=32):
+    """Classify many images with one forward per chunk of ``batch_size``.
+
+    Returns a list in input order of ``(results, error)`` pairs: ``results`` is the
+    top-k list for that image, or None with ``error`` set to the failure message,
+    so a single unreadable image does not fail the rest of the batch.
+    """
+    outputs = [None] * len(images)
+    buffer = thread_buffer(batch_size)
+    pending = []
+
+    def flush():
+        for i, results in zip(pending, predict_batch(buffer.view(len(pending)), model, topk)):
+            outputs[i] = (results, None)
+        pending.clear()
+
+    for i, image in enumerate(images):
+        try:
+            # Decoded straight into the reusable batch buffer, no per-image tensors or torch.cat
+            if not isinstance(image, torch.Tensor):
+                image = decode_image(image)
+            with STAGE_SECONDS.time(stage="transform"):
+                buffer.fill(len(pending), image)
+            pending.append(i)
+        except Exception as e:
+            outputs[i] = (None, str(e))
+        if len(pending) >= batch_size:
+            flush()
+    if pending:
+        flush()
+    return outputs
@@ -0,0 +1,131 @@
+import io
+import os
+import threading
+import warnings
+
+import numpy as np
+import torch
+from PIL import Image
+
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tif', '.tiff'}
+IMAGE_SIZE = (224, 224)
+MEAN = (0.485, 0.456, 0.406)
+STD = (0.229, 0.224, 0.225)
+# Reduced-size JPEG decoding. Numerically the exact path stays within 1e-6 of transforms_fn;
+# with draft on, expect mean |diff| ~0.01 and max |diff| ~0.1 (normalized units) on scans,
+# see benchmarks/bench_preprocess.py. Set JPEG_DRAFT=0 for the exact path.
+JPEG_DRAFT = os.environ.get("JPEG_DRAFT", "1") != "0"
+
+# ToTensor + Normalize is (x / 255 - mean) / std; folded into one multiply-add per pixel
+_SCALE = torch.tensor([1.0 / (255.0 * s) for s in STD]).view(3, 1, 1)
+_BIAS = torch.tensor([-m / s for m, s in zip(MEAN, STD)]).view(3, 1, 1)
+
+# PIL hands numpy a read-only buffer; it is only ever read from, so the warning is noise
+warnings.filterwarnings('ignore', message='The given NumPy array is not writable')
+
+
+def open_image(image):
+    """Open a path, raw bytes/memoryview, binary file-like object or PIL image without touching disk"""
+    if isinstance(image, Image.Image):
+        return image
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        image = io.BytesIO(image)
+    return Image.open(image)
+
+
+def list_images(root):
+    """Sorted paths of all image files under ``root``, recursively"""
+    paths = []
+    for directory, _, names in os.walk(root):
+        paths.extend(os.path.join(directory, name) for name in names
+                     if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS)
+    return sorted(paths)
+
+
+def decode(image, size=IMAGE_SIZE, draft=JPEG_DRAFT):
+    """Decode to an RGB PIL image resized to ``size`` (H, W), same resampling as ``transforms_fn``.
+
+    With ``draft`` JPEGs are DCT-downscaled while decoding (never below ``size``),
+    which skips most of the decode work for large scans at a small numerical cost.
+    """
+    img = open_image(image)
+    target = (size[1], size[0])
+    if draft and img.format == 'JPEG':
+        img.draft('RGB', target)
+    # Resizing before the RGB conversion is exact for L/RGB and 3x cheaper for grayscale scans
+    if img.mode not in ('L', 'RGB'):
+        img = img.convert('RGB')
+    if img.size != target:
+        img = img.resize(target, Image.BILINEAR)
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    return img
+
+
+def normalize_into(img, out):
+    """Write the normalized (3, H, W) float tensor for an RGB PIL image into ``out``"""
+    pixels = torch.from_numpy(np.asarray(img)).permute(2, 0, 1)
+    return torch.addcmul(_BIAS, pixels, _SCALE, out=out)
+
+
+def preprocess(image, size=IMAGE_SIZE, draft=JPEG_DRAFT):
+    """Fast replacement for ``transforms_fn``: returns a (3, H, W) float tensor"""
+    out = torch.empty((3,) + tuple(size))
+    return normalize_into(decode(image, size, draft), out)
+
+
+def heatmap_overlay(image, heatmap, size=IMAGE_SIZE, alpha=0.45):
+    """PNG bytes of ``image`` resized to ``size`` with a jet-coloured (h, w) heatmap in [0, 1] blended on top"""
+    base = np.asarray(decode(image, size), dtype=np.float32)
+    heat = Image.fromarray(np.asarray(heatmap, dtype=np.float32), mode='F').resize((size[1], size[0]),
+                                                                                   Image.BILINEAR)
+    heat = np.clip(np.asarray(heat), 0.0, 1.0)[..., None]
+    # Piecewise-linear jet: blue -> cyan -> yellow -> red
+    colours = np.clip(np.concatenate([1.5 - np.abs(4 * heat - 3), 1.5 - np.abs(4 * heat - 2),
+                                      1.5 - np.abs(4 * heat - 1)], axis=-1), 0.0, 1.0) * 255.0
+    blended = (1.0 - alpha * heat) * base + alpha * heat * colours
+    buf = io.BytesIO()
+    Image.fromarray(blended.round().astype(np.uint8), 'RGB').save(buf, 'PNG', optimize=True)
+    return buf.getvalue()
+
+
+class BatchBuffer:
+    """Preallocated (N, 3, H, W) input batch that is refilled instead of reallocated.
+
+    ``view(n)`` is only valid until the buffer is filled again, so each thread
+    should use its own buffer (see ``thread_buffer``).
+    """
+
+    def __init__(self, capacity, size=IMAGE_SIZE):
+        self.size = tuple(size)
+        self.data = torch.empty((capacity, 3) + self.size)
+
+    @property
+    def capacity(self):
+        return self.data.shape[0]
+
+    def reserve(self, capacity):
+        if capacity > self.capacity:
+            self.data = torch.empty((capacity, 3) + self.size)
+
+    def fill(self, index, image, draft=JPEG_DRAFT):
+        """Decode and normalize ``image`` into slot ``index``"""
+        if isinstance(image, torch.Tensor):
+            self.data[index].copy_(image.reshape(self.data.shape[1:]))
+        else:
+            normalize_into(decode(image, self.size, draft), self.data[index])
+
+    def view(self, n):
+        return self.data[:n]
+
+
+_local = threading.local()
+
+
+def thread_buffer(capacity, size=IMAGE_SIZE):
+    """Per-thread BatchBuffer with room for at least ``capacity`` images"""
+    buffer = getattr(_local, 'buffer', None)
+    if buffer is None or buffer.size != tuple(size):
+        buffer = _local.buffer = BatchBuffer(capacity, size)
+    buffer.reserve(capacity)
+    return buffer
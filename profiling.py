@@ -0,0 +1,94 @@
+"""On-demand torch.profiler tracing of individual requests.
+
+A request is profiled when it carries the ``X-Profile`` header, when it is
+picked by ``PROFILE_SAMPLE_RATE``, or when an admin has armed the next N
+requests. Profiled requests record operator shapes and memory and write a
+Chrome trace (open in chrome://tracing or Perfetto) to ``PROFILE_DIR``, keeping
+only the newest ``PROFILE_MAX_TRACES`` files. When nothing is armed the check is
+a couple of comparisons and the profiler is never entered.
+"""
+import contextlib
+import os
+import random
+import threading
+import time
+import uuid
+
+import torch
+from torch.profiler import ProfilerActivity, profile, record_function
+
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "traces")
+PROFILE_MAX_TRACES = int(os.environ.get("PROFILE_MAX_TRACES", 50))
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+# The X-Profile header and the admin endpoint must present this token; unset disables both
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN", "")
+PROFILE_HEADER = "X-Profile"
+
+
+class RequestProfiler:
+    def __init__(self, trace_dir=PROFILE_DIR, max_traces=PROFILE_MAX_TRACES, sample_rate=PROFILE_SAMPLE_RATE):
+        self.trace_dir = trace_dir
+        self.max_traces = max_traces
+        self.sample_rate = sample_rate
+        self._armed = 0
+        self._lock = threading.Lock()
+        self.traces_written = 0
+
+    def arm(self, count):
+        """Profile the next ``count`` requests (replaces any remaining count)"""
+        with self._lock:
+            self._armed = max(0, int(count))
+        return self._armed
+
+    def should_profile(self, flagged=False):
+        if flagged:
+            return True
+        if self._armed:
+            with self._lock:
+                if self._armed:
+                    self._armed -= 1
+                    return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    @contextlib.contextmanager
+    def trace(self, name="predict"):
+        """Profile the enclosed block; yields the trace ID the Chrome trace is saved under"""
+        trace_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        activities = [ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(ProfilerActivity.CUDA)
+        with profile(activities=activities, record_shapes=True, profile_memory=True) as prof:
+            with record_function(name):
+                yield trace_id
+        os.makedirs(self.trace_dir, exist_ok=True)
+        prof.export_chrome_trace(self.path(trace_id))
+        self.traces_written += 1
+        self._rotate()
+
+    def path(self, trace_id):
+        return os.path.join(self.trace_dir, f"{trace_id}.json")
+
+    def traces(self):
+        """Trace IDs on disk, oldest first"""
+        try:
+            names = [n for n in os.listdir(self.trace_dir) if n.endswith(".json")]
+        except FileNotFoundError:
+            return []
+        names.sort(key=lambda n: os.path.getmtime(os.path.join(self.trace_dir, n)))
+        return [n[:-len(".json")] for n in names]
+
+    def _rotate(self):
+        for trace_id in self.traces()[:-self.max_traces or None]:
+            try:
+                os.remove(self.path(trace_id))
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        return {
+            "armed": self._armed,
+            "sample_rate": self.sample_rate,
+            "traces_written": self.traces_written,
+            "max_traces": self.max_traces,
+            "traces": self.traces(),
+        }
@@ -0,0 +1,136 @@
+"""INT8 CPU variants of the classifier and an FP32-vs-INT8 parity report.
+
+Static post-training quantization (FX graph mode, x86/fbgemm) calibrates
+activation ranges on a folder of representative scans. When no calibration
+data is available, or static conversion fails, only the final Linear is
+quantized dynamically.
+
+    python quantize.py model.pth --calibration-dir calib/ --labelled-dir val/ --output report.json
+
+``val/`` holds one sub-folder per class name (glioma/, meningioma/, ...).
+"""
+import argparse
+import copy
+import json
+import os
+
+import torch
+
+from predict import CLASS_NAMES, build_model, load_checkpoint
+from preprocess import BatchBuffer, list_images
+
+QUANTIZATION_MODES = ('none', 'static', 'dynamic')
+
+
+def _batches(paths, batch_size):
+    buffer = BatchBuffer(batch_size)
+    for start in range(0, len(paths), batch_size):
+        chunk = paths[start:start + batch_size]
+        for i, path in enumerate(chunk):
+            buffer.fill(i, path)
+        yield chunk, buffer.view(len(chunk))
+
+
+def quantize_dynamic(model):
+    """INT8 weights for the final Linear only; activations stay FP32"""
+    return torch.ao.quantization.quantize_dynamic(
+        copy.deepcopy(model).cpu().eval(), {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def quantize_static(model, calibration_dir, max_images=256, batch_size=16):
+    """INT8 weights and activations, calibrated on up to ``max_images`` scans"""
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    paths = list_images(calibration_dir)[:max_images] if calibration_dir else []
+    if not paths:
+        raise ValueError(f"No calibration images found in {calibration_dir!r}")
+    torch.backends.quantized.engine = 'x86'
+    example = torch.zeros((1, 3, 224, 224))
+    prepared = prepare_fx(copy.deepcopy(model).cpu().eval(),
+                          get_default_qconfig_mapping('x86'), example_inputs=(example,))
+    with torch.no_grad():
+        for _, batch in _batches(paths, batch_size):
+            prepared(batch)
+    return convert_fx(prepared)
+
+
+def quantize_model(model, mode, calibration_dir=None):
+    """Return the INT8 variant of ``model`` for ``mode``; static falls back to dynamic"""
+    if mode == 'none':
+        return model
+    if mode == 'static':
+        try:
+            return quantize_static(model, calibration_dir)
+        except Exception as e:
+            print(f"Static quantization unavailable ({e}), falling back to dynamic")
+            return quantize_dynamic(model)
+    if mode == 'dynamic':
+        return quantize_dynamic(model)
+    raise ValueError(f"Unknown quantization mode: {mode} (expected one of {', '.join(QUANTIZATION_MODES)})")
+
+
+def parity_report(fp32_model, int8_model, labelled_dir, batch_size=16):
+    """Per-class FP32/INT8 agreement, accuracy and confidence deltas over ``labelled_dir/<class>/``"""
+    per_class = {}
+    for label in CLASS_NAMES:
+        paths = list_images(os.path.join(labelled_dir, label))
+        stats = {"images": len(paths), "agree": 0, "fp32_correct": 0, "int8_correct": 0,
+                 "confidence_delta_sum": 0.0, "confidence_delta_max": 0.0}
+        with torch.no_grad():
+            for _, batch in _batches(paths, batch_size):
+                fp32 = torch.softmax(fp32_model(batch).float(), dim=1)
+                int8 = torch.softmax(int8_model(batch).float(), dim=1)
+                fp32_pred, int8_pred = fp32.argmax(dim=1), int8.argmax(dim=1)
+                target = CLASS_NAMES.index(label)
+                # Confidence delta is measured on the class FP32 predicted
+                delta = (int8.gather(1, fp32_pred[:, None]) - fp32.gather(1, fp32_pred[:, None])).abs()
+                stats["agree"] += int((fp32_pred == int8_pred).sum())
+                stats["fp32_correct"] += int((fp32_pred == target).sum())
+                stats["int8_correct"] += int((int8_pred == target).sum())
+                stats["confidence_delta_sum"] += float(delta.sum())
+                stats["confidence_delta_max"] = max(stats["confidence_delta_max"], float(delta.max()))
+        per_class[label] = stats
+
+    def summarize(stats):
+        n = stats["images"]
+        return {
+            "images": n,
+            "agreement": stats["agree"] / n if n else None,
+            "fp32_accuracy": stats["fp32_correct"] / n if n else None,
+            "int8_accuracy": stats["int8_correct"] / n if n else None,
+            "mean_confidence_delta": stats["confidence_delta_sum"] / n if n else None,
+            "max_confidence_delta": stats["confidence_delta_max"] if n else None,
+        }
+
+    total = {key: sum(stats[key] for stats in per_class.values())
+             for key in ("images", "agree", "fp32_correct", "int8_correct", "confidence_delta_sum")}
+    total["confidence_delta_max"] = max((s["confidence_delta_max"] for s in per_class.values()), default=0.0)
+    return {
+        "classes": {label: summarize(stats) for label, stats in per_class.items()},
+        "overall": summarize(total),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Quantize the checkpoint and report FP32/INT8 parity")
+    parser.add_argument('checkpoint')
+    parser.add_argument('--mode', choices=QUANTIZATION_MODES[1:], default='static')
+    parser.add_argument('--calibration-dir')
+    parser.add_argument('--labelled-dir', required=True)
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--output', help="write the report as JSON here as well")
+    args = parser.parse_args()
+
+    fp32_model = load_checkpoint(build_model(empty=True), args.checkpoint).cpu()
+    int8_model = quantize_model(fp32_model, args.mode, args.calibration_dir)
+    report = parity_report(fp32_model, int8_model, args.labelled_dir, args.batch_size)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+
+if __name__ == '__main__':
+    main()
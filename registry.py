@@ -0,0 +1,241 @@
+"""Registry of named, versioned models with hot-swap, A/B traffic and memory-bounded residency.
+
+Each model name has a traffic map of version -> weight; requests that do not
+pin a version are routed by weighted random choice over it. A new version is
+loaded and validated in the background and only then added to the traffic map,
+so requests already running on the old version finish on it and none are
+dropped. Versions outside every traffic map are unloaded least-recently-used
+first whenever the loaded weights exceed the memory budget; a pinned request
+for an unloaded version loads it again on demand.
+"""
+import contextlib
+import random
+import threading
+import time
+
+import torch
+
+from predict import CLASS_NAMES, predict_probs
+
+
+class ModelVersion:
+    def __init__(self, name, version, path, arch="resnext50_32x4d"):
+        self.name = name
+        self.version = version
+        self.path = path
+        self.arch = arch
+        self.state = "registered"
+        self.error = None
+        self.model = None
+        self.backend = None
+        self.batcher = None
+        self.fingerprint = None
+        self.nbytes = 0
+        self.in_flight = 0
+        self.last_used = 0.0
+        self.timings = {}
+        self.load_lock = threading.Lock()
+
+    def attach(self, model, backend, batcher, fingerprint):
+        self.model, self.backend, self.batcher, self.fingerprint = model, backend, batcher, fingerprint
+        self.nbytes = sum(t.numel() * t.element_size()
+                          for t in list(model.parameters()) + list(model.buffers()))
+        self.error = None
+        self.state = "ready"
+
+    def unload(self):
+        if self.batcher is not None:
+            self.batcher.close()
+        self.model = self.backend = self.batcher = None
+        self.nbytes = 0
+        self.state = "unloaded"
+
+    def info(self):
+        return {
+            "path": self.path,
+            "arch": self.arch,
+            "state": self.state,
+            "error": self.error,
+            "fingerprint": self.fingerprint,
+            "memory_mb": round(self.nbytes / 2**20, 1),
+            "in_flight": self.in_flight,
+            "idle_seconds": round(time.monotonic() - self.last_used, 1) if self.last_used else None,
+            "load_timings_ms": self.timings,
+        }
+
+
+def validate(backend, batch_size=2):
+    """Reject a freshly loaded version whose forward does not produce finite class probabilities"""
+    probs = predict_probs(torch.zeros(batch_size, 3, 224, 224), backend)
+    if probs.shape != (batch_size, len(CLASS_NAMES)):
+        raise ValueError(f"Expected {len(CLASS_NAMES)} classes, model produced shape {tuple(probs.shape)}")
+    if not torch.isfinite(probs).all():
+        raise ValueError("Model produced non-finite outputs")
+
+
+class ModelRegistry:
+    def __init__(self, loader, memory_budget_bytes=0, on_activate=None):
+        # loader(version) -> (model, backend, batcher, fingerprint); on_activate(name, version) after swaps
+        self.loader = loader
+        self.memory_budget_bytes = memory_budget_bytes
+        self.on_activate = on_activate
+        self._versions = {}
+        self._traffic = {}
+        self._lock = threading.Lock()
+        self.default_name = None
+
+    def register(self, name, version, path, arch="resnext50_32x4d"):
+        with self._lock:
+            existing = self._versions.get((name, version))
+            if existing is not None:
+                if existing.path != path or existing.arch != arch:
+                    raise ValueError(f"{name}:{version} is already registered with a different checkpoint")
+                return existing
+            mv = self._versions[(name, version)] = ModelVersion(name, version, path, arch)
+            if self.default_name is None:
+                self.default_name = name
+            return mv
+
+    def add_loaded(self, name, version, path, model, backend, batcher, fingerprint, arch="resnext50_32x4d"):
+        """Register a version that was loaded outside the registry (e.g. at start-up)"""
+        mv = self.register(name, version, path, arch)
+        mv.attach(model, backend, batcher, fingerprint)
+        mv.last_used = time.monotonic()
+        return mv
+
+    def versions(self):
+        with self._lock:
+            return list(self._versions.values())
+
+    def get(self, name, version):
+        try:
+            return self._versions[(name or self.default_name, version)]
+        except KeyError:
+            raise LookupError(f"Unknown model version {name or self.default_name}:{version}") from None
+
+    def load(self, name, version):
+        """Load and validate a registered version (no-op when already loaded)"""
+        mv = self.get(name, version)
+        with mv.load_lock:
+            if mv.state == "ready":
+                return mv
+            mv.state = "loading"
+            try:
+                mv.timings = {}
+                model, backend, batcher, fingerprint = self.loader(mv)
+                validate(backend)
+            except Exception as e:
+                mv.state, mv.error = "failed", str(e)
+                raise
+            with self._lock:
+                mv.attach(model, backend, batcher, fingerprint)
+                mv.last_used = time.monotonic()
+        # Make room by unloading others: the caller has not had a chance to use or activate this one yet
+        self._evict(keep=mv)
+        return mv
+
+    def load_async(self, name, version, activate=False):
+        """Load in a background thread, then optionally make it the only version receiving traffic"""
+        mv = self.get(name, version)
+
+        def run():
+            # Held like a request until activated, so no eviction can slip in between load and traffic
+            with self._lock:
+                mv.in_flight += 1
+            try:
+                self.load(name, version)
+                if activate:
+                    self.set_traffic(name, {version: 1.0})
+            except Exception as e:
+                if mv.state == "ready":
+                    mv.error = f"Activation failed: {e}"
+                print(f"Loading {name}:{version} failed: {e}")
+            finally:
+                with self._lock:
+                    mv.in_flight -= 1
+                self._evict()
+        thread = threading.Thread(target=run, name=f"load-{name}-{version}", daemon=True)
+        thread.start()
+        return thread
+
+    def set_traffic(self, name, weights):
+        """Atomically replace the version -> weight split for ``name``; versions must be loaded"""
+        weights = {str(v): float(w) for v, w in weights.items() if float(w) > 0}
+        if not weights:
+            raise ValueError("At least one version needs a positive weight")
+        for version in weights:
+            if self.get(name, version).state != "ready":
+                raise ValueError(f"{name}:{version} is not loaded")
+        with self._lock:
+            self._traffic[name] = weights
+        if self.on_activate is not None:
+            self.on_activate(name, self.primary(name))
+        self._evict()
+
+    def primary(self, name=None):
+        """The highest-weighted version of ``name`` (the one that gets most traffic)"""
+        name = name or self.default_name
+        traffic = self._traffic.get(name)
+        if not traffic:
+            return None
+        return self.get(name, max(traffic, key=traffic.get))
+
+    def _pick(self, name):
+        traffic = self._traffic.get(name)
+        if not traffic:
+            raise LookupError(f"No version of {name} is receiving traffic")
+        versions = list(traffic)
+        return random.choices(versions, weights=[traffic[v] for v in versions])[0]
+
+    @contextlib.contextmanager
+    def acquire(self, name=None, version=None):
+        """The version serving one request: pinned by ``version``, else drawn from the traffic split.
+
+        The version cannot be unloaded while the block runs.
+        """
+        name = name or self.default_name
+        with self._lock:
+            mv = self.get(name, version if version is not None else self._pick(name))
+            mv.in_flight += 1
+        try:
+            if mv.state != "ready":
+                self.load(mv.name, mv.version)
+            mv.last_used = time.monotonic()
+            yield mv
+        finally:
+            with self._lock:
+                mv.in_flight -= 1
+            self._evict()
+
+    def _evict(self, keep=None):
+        if not self.memory_budget_bytes:
+            return
+        with self._lock:
+            active = {(name, v) for name, traffic in self._traffic.items() for v in traffic}
+            if keep is not None:
+                active.add((keep.name, keep.version))
+            loaded = [mv for mv in self._versions.values() if mv.state == "ready"]
+            total = sum(mv.nbytes for mv in loaded)
+            candidates = sorted((mv for mv in loaded
+                                 if (mv.name, mv.version) not in active and mv.in_flight == 0),
+                                key=lambda mv: mv.last_used)
+            for mv in candidates:
+                if total <= self.memory_budget_bytes:
+                    break
+                total -= mv.nbytes
+                mv.unload()
+                print(f"Unloaded idle model {mv.name}:{mv.version} to stay within the memory budget")
+
+    def stats(self):
+        with self._lock:
+            models = {}
+            for (name, version), mv in self._versions.items():
+                entry = models.setdefault(name, {"traffic": dict(self._traffic.get(name, {})), "versions": {}})
+                entry["versions"][version] = mv.info()
+            loaded = sum(mv.nbytes for mv in self._versions.values() if mv.state == "ready")
+            return {
+                "default": self.default_name,
+                "memory_budget_mb": round(self.memory_budget_bytes / 2**20, 1),
+                "loaded_mb": round(loaded / 2**20, 1),
+                "models": models,
+            }
@@ -0,0 +1,158 @@
+"""Offline bulk scoring of a directory tree or a file list.
+
+    python score.py model.pth --input-dir archive/ --output scores.jsonl --workers 8 --batch-size 64
+
+Images are decoded and transformed in DataLoader worker processes with
+prefetching, scored with one forward per batch and streamed to JSONL or CSV
+(chosen by the output extension). After every batch the output is flushed and a
+``<output>.progress`` checkpoint records how many inputs and bytes are done, so
+re-running the same command resumes where an interrupted job stopped.
+"""
+import argparse
+import csv
+import hashlib
+import io
+import json
+import os
+import sys
+import time
+
+import torch
+from torch.utils.data import DataLoader, Dataset
+
+from backends import BACKENDS, load_backend
+from predict import CLASS_NAMES, build_model, load_checkpoint, predict_batch
+from preprocess import list_images, preprocess
+
+CSV_FIELDS = ["path", "prediction", "confidence"] + CLASS_NAMES + ["error"]
+
+
+class ImageFiles(Dataset):
+    def __init__(self, paths):
+        self.paths = paths
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, index):
+        try:
+            return preprocess(self.paths[index]), ""
+        except Exception as e:
+            return torch.zeros(3, 224, 224), str(e) or type(e).__name__
+
+
+def collate(items):
+    return torch.stack([tensor for tensor, _ in items]), [error for _, error in items]
+
+
+def read_inputs(input_dir, file_list):
+    if input_dir:
+        return list_images(input_dir)
+    with open(file_list, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def inputs_digest(paths):
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(path.encode('utf-8', 'surrogateescape') + b'\n')
+    return digest.hexdigest()
+
+
+def load_progress(progress_path, digest):
+    """(images done, output bytes written) from a previous run over the same inputs"""
+    try:
+        with open(progress_path, 'r', encoding='utf-8') as f:
+            progress = json.load(f)
+    except (OSError, ValueError):
+        return 0, 0
+    if progress.get("inputs") != digest:
+        raise SystemExit(f"{progress_path} belongs to a different input list; "
+                         f"remove it or choose another --output")
+    return progress["done"], progress["output_bytes"]
+
+
+def save_progress(progress_path, digest, done, total, output_bytes):
+    tmp_path = progress_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({"inputs": digest, "done": done, "total": total, "output_bytes": output_bytes}, f)
+    os.replace(tmp_path, progress_path)
+
+
+def format_rows(paths, probs, errors, fmt):
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, CSV_FIELDS) if fmt == 'csv' else None
+    for path, row, error in zip(paths, probs, errors):
+        record = {"path": path}
+        if error:
+            record.update({"prediction": None, "confidence": None, "error": error})
+        else:
+            # Rows come back sorted by probability, all classes included
+            record.update({"prediction": row[0][0], "confidence": row[0][1],
+                           "probabilities": dict(row), "error": None})
+        if writer is None:
+            buf.write(json.dumps(record) + "\n")
+        else:
+            flat = {k: v for k, v in record.items() if k != "probabilities"}
+            flat.update(record.get("probabilities", {}))
+            writer.writerow(flat)
+    return buf.getvalue().encode('utf-8')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score a directory tree or file list in batches")
+    parser.add_argument('checkpoint')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--input-dir')
+    source.add_argument('--file-list', help="text file with one image path per line")
+    parser.add_argument('--output', required=True, help=".jsonl or .csv")
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) - 1),
+                        help="decode/transform processes")
+    parser.add_argument('--prefetch', type=int, default=4, help="batches prefetched per worker")
+    parser.add_argument('--backend', choices=BACKENDS, default='eager')
+    parser.add_argument('--threads', type=int, default=0, help="intra-op threads for the forward")
+    args = parser.parse_args()
+
+    fmt = 'csv' if args.output.lower().endswith('.csv') else 'jsonl'
+    paths = read_inputs(args.input_dir, args.file_list)
+    digest = inputs_digest(paths)
+    progress_path = args.output + '.progress'
+    done, output_bytes = load_progress(progress_path, digest)
+    if done >= len(paths):
+        print(f"All {len(paths)} inputs already scored in {args.output}")
+        return
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    model = load_checkpoint(build_model(empty=True), args.checkpoint)
+    backend = load_backend(args.backend, model, args.checkpoint)
+
+    remaining = paths[done:]
+    loader = DataLoader(ImageFiles(remaining), batch_size=args.batch_size, num_workers=args.workers,
+                        collate_fn=collate, prefetch_factor=args.prefetch if args.workers else None,
+                        persistent_workers=False)
+
+    mode = 'r+b' if os.path.exists(args.output) else 'wb'
+    with open(args.output, mode) as out:
+        # Drop anything written after the last checkpoint, then continue from there
+        out.seek(output_bytes)
+        out.truncate()
+        if output_bytes == 0 and fmt == 'csv':
+            out.write((",".join(CSV_FIELDS) + "\r\n").encode('utf-8'))
+        started, scored = time.perf_counter(), 0
+        for batch, errors in loader:
+            batch_paths = remaining[scored:scored + len(errors)]
+            results = predict_batch(batch, backend, topk=len(CLASS_NAMES))
+            out.write(format_rows(batch_paths, results, errors, fmt))
+            out.flush()
+            os.fsync(out.fileno())
+            scored += len(errors)
+            save_progress(progress_path, digest, done + scored, len(paths), out.tell())
+            rate = scored / (time.perf_counter() - started)
+            print(f"\r{done + scored}/{len(paths)} images, {rate:.1f} img/s", end="", file=sys.stderr)
+    print(file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
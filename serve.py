@@ -0,0 +1,169 @@
+"""Pre-fork production launcher.
+
+The parent process loads the model once, freezes the Python heap and forks N
+workers that accept connections on one shared listening socket. Model weights
+are inherited copy-on-write (or placed in shared memory with --share-memory),
+so the node pays for one copy of the weights, and each worker gets an explicit
+intra-op thread budget and optionally its own set of CPU cores.
+
+Every worker has its own model registry, so with more than one worker the
+versions and traffic split come from MODEL_REGISTRY at start-up and the
+/admin/models routes refuse changes (they would reach a single worker).
+
+    python serve.py --workers 4 --threads 2 --pin-cores --port 5000
+"""
+import argparse
+import gc
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+import torch
+from werkzeug.serving import make_server
+
+import app as webapp
+from backends import OnnxBackend
+
+
+def available_cpus():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def core_sets(workers, threads):
+    """Split the CPUs this process may use into one contiguous block per worker"""
+    cpus = available_cpus()
+    sets = []
+    for i in range(workers):
+        start = (i * threads) % len(cpus)
+        sets.append([cpus[(start + j) % len(cpus)] for j in range(min(threads, len(cpus)))])
+    return sets
+
+
+def bind_socket(host, port, backlog=2048):
+    sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def load_shared_model(share_memory):
+    # One intra-op thread while loading: a parent that never starts an OpenMP pool
+    # can fork safely, and each worker sizes its own pool afterwards.
+    torch.set_num_threads(1)
+    gc.disable()
+    webapp.load_model()
+    if webapp.model is None:
+        raise SystemExit("Model failed to load; not starting workers")
+    if share_memory:
+        webapp.model.share_memory()
+        backend_model = getattr(webapp.backend, 'model', None)
+        if isinstance(backend_model, torch.nn.Module):
+            backend_model.share_memory()
+    # Move everything allocated so far out of the collector's reach so that GC passes
+    # in the workers don't write to (and thereby un-share) the parent's pages.
+    gc.collect()
+    gc.freeze()
+    gc.enable()
+
+
+def run_worker(index, sock, threads, cpus):
+    if cpus and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+    torch.set_num_threads(threads)
+    webapp.backend_threads = threads
+    # ONNX Runtime thread pools do not survive fork(); open a fresh session per worker for every version
+    fresh = {}
+    versions = webapp.registry.versions() if webapp.registry is not None else []
+    for mv in versions:
+        if isinstance(mv.backend, OnnxBackend):
+            old = mv.backend
+            mv.backend = mv.batcher.model = fresh[id(old)] = OnnxBackend(old.path, threads)
+    if isinstance(webapp.backend, OnnxBackend):
+        webapp.backend = webapp.batcher.model = (fresh.get(id(webapp.backend))
+                                                 or OnnxBackend(webapp.backend.path, threads))
+    signal.signal(signal.SIGTERM, lambda *_: os._exit(0))
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    server = make_server('', 0, webapp.app, threaded=True, fd=sock.fileno())
+    print(f"worker {index} pid={os.getpid()} threads={threads} cpus={cpus or 'any'}")
+    sys.stdout.flush()
+    server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-fork multi-worker server for app.py")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=0, help="default: one per CPU / --threads")
+    parser.add_argument('--threads', type=int, default=0, help="intra-op threads per worker")
+    parser.add_argument('--pin-cores', action='store_true', help="pin each worker to its own CPU cores")
+    parser.add_argument('--share-memory', action='store_true',
+                        help="move weights into shared memory instead of relying on copy-on-write")
+    args = parser.parse_args()
+
+    cpus = available_cpus()
+    threads = args.threads or max(1, len(cpus) // (args.workers or len(cpus)))
+    workers = args.workers or max(1, len(cpus) // threads)
+    pinning = core_sets(workers, threads) if args.pin_cores else [None] * workers
+
+    sock = bind_socket(args.host, args.port)
+    webapp.worker_count = workers
+    load_shared_model(args.share_memory)
+    job_dir = None
+    if workers > 1 and webapp.job_queue.directory is None:
+        # A job's status and event requests may reach any worker, not just the one that accepted it
+        job_dir = tempfile.mkdtemp(prefix="jobs-")
+        webapp.job_queue.use_directory(job_dir)
+    print(f"Serving on {args.host}:{args.port} with {workers} workers x {threads} threads")
+
+    children = {}
+    stopping = False
+
+    def spawn(index):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(index, sock, threads, pinning[index])
+            finally:
+                os._exit(1)
+        children[pid] = index
+
+    def stop(*_):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for index in range(workers):
+        spawn(index)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        index = children.pop(pid, None)
+        if index is not None and not stopping:
+            print(f"worker {index} pid={pid} exited with status {status}, restarting")
+            time.sleep(1)
+            spawn(index)
+    if job_dir is not None:
+        shutil.rmtree(job_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
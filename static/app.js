@@ -0,0 +1,317 @@
+const uploadArea = document.getElementById('upload-area');
+const fileInput = document.getElementById('file-input');
+const previewContainer = document.getElementById('preview-container');
+const imagePreview = document.getElementById('image-preview');
+const predictBtn = document.getElementById('predict-btn');
+const results = document.getElementById('results');
+const predictionText = document.getElementById('prediction-text');
+const confidenceText = document.getElementById('confidence-text');
+const jobResults = document.getElementById('job-results');
+const errorMessage = document.getElementById('error-message');
+const loading = document.getElementById('loading');
+
+let currentFile = null;
+let currentFiles = [];
+
+// Images are downscaled and re-encoded in the browser before upload, to the longest
+// side and quality the server advertises; the original is sent if that fails or is larger
+let uploadConfig = null;
+const configReady = fetch('/config/upload')
+    .then(response => response.json())
+    .then(config => { uploadConfig = config; })
+    .catch(() => {});
+
+async function encodeScaled(file, maxSide, types, quality) {
+    const bitmap = await createImageBitmap(file);
+    const scale = Math.min(1, maxSide / Math.max(bitmap.width, bitmap.height));
+    const width = Math.max(1, Math.round(bitmap.width * scale));
+    const height = Math.max(1, Math.round(bitmap.height * scale));
+    let canvas;
+    if (typeof OffscreenCanvas !== 'undefined') {
+        canvas = new OffscreenCanvas(width, height);
+    } else {
+        canvas = document.createElement('canvas');
+        canvas.width = width;
+        canvas.height = height;
+    }
+    const ctx = canvas.getContext('2d');
+    ctx.imageSmoothingEnabled = true;
+    ctx.imageSmoothingQuality = 'high';
+    ctx.drawImage(bitmap, 0, 0, width, height);
+    bitmap.close();
+    for (const type of types) {
+        const blob = canvas.convertToBlob
+            ? await canvas.convertToBlob({ type: type, quality: quality })
+            : await new Promise(resolve => canvas.toBlob(resolve, type, quality));
+        // Browsers fall back to PNG for types they cannot encode
+        if (blob && blob.type === type) {
+            return blob;
+        }
+    }
+    return null;
+}
+
+// Off the main thread when the browser supports OffscreenCanvas in workers
+let resizeWorker = null;
+// Calls in flight, by the id each message carries there and back
+const pendingResizes = new Map();
+let nextResizeId = 0;
+if (window.Worker && typeof OffscreenCanvas !== 'undefined') {
+    try {
+        const source = encodeScaled.toString() +
+            ';self.onmessage = e => encodeScaled(...e.data.args).then(' +
+            'blob => self.postMessage({ id: e.data.id, blob: blob }), ' +
+            'error => self.postMessage({ id: e.data.id, error: String(error) }));';
+        resizeWorker = new Worker(URL.createObjectURL(new Blob([source], { type: 'text/javascript' })));
+        resizeWorker.onmessage = e => {
+            const pending = pendingResizes.get(e.data.id);
+            pendingResizes.delete(e.data.id);
+            if (pending) {
+                e.data.error ? pending.reject(new Error(e.data.error)) : pending.resolve(e.data.blob);
+            }
+        };
+        // A worker-level error cannot be tied to one call, so every call in flight falls back
+        resizeWorker.onerror = e => {
+            pendingResizes.forEach(pending => pending.reject(new Error(e.message)));
+            pendingResizes.clear();
+        };
+    } catch (e) {
+        resizeWorker = null;
+    }
+}
+
+function encodeInWorker(args) {
+    return new Promise((resolve, reject) => {
+        const id = nextResizeId++;
+        pendingResizes.set(id, { resolve: resolve, reject: reject });
+        resizeWorker.postMessage({ id: id, args: args });
+    });
+}
+
+async function prepareUpload(file) {
+    await configReady;
+    if (!uploadConfig || !uploadConfig.max_side || !window.createImageBitmap) {
+        return file;
+    }
+    const args = [file, uploadConfig.max_side, uploadConfig.types, uploadConfig.quality];
+    let blob = null;
+    try {
+        blob = resizeWorker ? await encodeInWorker(args) : await encodeScaled(...args);
+    } catch (e) {
+        try {
+            blob = await encodeScaled(...args);
+        } catch (e2) {
+            blob = null;
+        }
+    }
+    if (!blob || blob.size >= file.size) {
+        return file;
+    }
+    const name = file.name.replace(/[.][^.]*$/, '') + (blob.type === 'image/webp' ? '.webp' : '.jpg');
+    return new File([blob], name, { type: blob.type });
+}
+
+// Drag and drop functionality
+['dragenter', 'dragover', 'dragleave', 'drop'].forEach(eventName => {
+    uploadArea.addEventListener(eventName, preventDefaults, false);
+});
+
+function preventDefaults(e) {
+    e.preventDefault();
+    e.stopPropagation();
+}
+
+['dragenter', 'dragover'].forEach(eventName => {
+    uploadArea.addEventListener(eventName, highlight, false);
+});
+
+['dragleave', 'drop'].forEach(eventName => {
+    uploadArea.addEventListener(eventName, unhighlight, false);
+});
+
+function highlight() {
+    uploadArea.classList.add('highlight');
+}
+
+function unhighlight() {
+    uploadArea.classList.remove('highlight');
+}
+
+uploadArea.addEventListener('drop', handleDrop, false);
+
+function handleDrop(e) {
+    const dt = e.dataTransfer;
+    const files = dt.files;
+    handleFiles(files);
+}
+
+fileInput.addEventListener('change', function() {
+    handleFiles(this.files);
+});
+
+function handleFiles(files) {
+    const images = Array.from(files).filter(file => file.type.startsWith('image/'));
+    if (images.length > 0) {
+        currentFile = images[0];
+        currentFiles = images;
+        showPreview(currentFile);
+        hideError();
+        hideResults();
+        predictBtn.textContent = images.length > 1 ? `Predict ${images.length} Images` : 'Predict Image';
+        predictBtn.style.display = 'block';
+    } else if (files.length > 0) {
+        showError('Please select a valid image file.');
+    }
+}
+
+function showPreview(file) {
+    const reader = new FileReader();
+    reader.onload = function(e) {
+        imagePreview.src = e.target.result;
+        previewContainer.style.display = 'block';
+    };
+    reader.readAsDataURL(file);
+}
+
+function predictImage() {
+    if (!currentFile) {
+        showError('Please select an image first.');
+        return;
+    }
+
+    showLoading();
+    hideError();
+    hideResults();
+    predictBtn.disabled = true;
+
+    if (currentFiles.length > 1) {
+        submitJob(currentFiles);
+        return;
+    }
+
+    prepareUpload(currentFile)
+    .then(upload => {
+        const formData = new FormData();
+        formData.append('image', upload);
+        return fetch('/predict', {
+            method: 'POST',
+            body: formData
+        });
+    })
+    .then(response => response.json())
+    .then(data => {
+        hideLoading();
+        predictBtn.disabled = false;
+
+        if (data.error) {
+            showError(data.error);
+        } else {
+            showResults(data.prediction, data.confidence);
+        }
+    })
+    .catch(error => {
+        hideLoading();
+        predictBtn.disabled = false;
+        showError('Network error: ' + error.message);
+    });
+}
+
+// Several images go through the job API; results are rendered as the server streams them
+function submitJob(files) {
+    Promise.all(files.map(prepareUpload))
+    .then(uploads => {
+        const formData = new FormData();
+        uploads.forEach(upload => formData.append('images', upload));
+        return fetch('/jobs', {
+            method: 'POST',
+            body: formData
+        });
+    })
+    .then(response => response.json())
+    .then(job => {
+        if (job.error) {
+            throw new Error(job.error);
+        }
+        showProgress(0, job.total);
+        const events = new EventSource(job.events_url);
+        events.addEventListener('result', e => {
+            const entry = JSON.parse(e.data);
+            addJobResult(entry);
+            showProgress(entry.completed, entry.total);
+        });
+        events.addEventListener('done', () => {
+            events.close();
+            hideLoading();
+            predictBtn.disabled = false;
+        });
+        // EventSource reconnects by itself (resuming from the last event); CLOSED means it gave up
+        events.onerror = () => {
+            if (events.readyState === EventSource.CLOSED) {
+                hideLoading();
+                predictBtn.disabled = false;
+                showError('Lost the connection to the result stream.');
+            }
+        };
+    })
+    .catch(error => {
+        hideLoading();
+        predictBtn.disabled = false;
+        showError('Network error: ' + error.message);
+    });
+}
+
+function showProgress(completed, total) {
+    predictionText.textContent = `${completed} / ${total} images`;
+    confidenceText.textContent = '';
+    results.style.display = 'block';
+}
+
+function addJobResult(entry) {
+    const item = document.createElement('li');
+    const name = document.createElement('span');
+    const outcome = document.createElement('span');
+    name.textContent = entry.filename;
+    if (entry.status === 'success') {
+        outcome.textContent = `${entry.prediction} (${(entry.confidence * 100).toFixed(2)}%)`;
+    } else {
+        item.className = 'failed';
+        outcome.textContent = entry.error;
+    }
+    item.append(name, outcome);
+    jobResults.appendChild(item);
+}
+
+function showLoading() {
+    loading.style.display = 'block';
+}
+
+function hideLoading() {
+    loading.style.display = 'none';
+}
+
+function showResults(prediction, confidence) {
+    predictionText.textContent = prediction;
+    confidenceText.textContent = `Confidence: ${(confidence * 100).toFixed(2)}%`;
+    results.style.display = 'block';
+}
+
+function hideResults() {
+    results.style.display = 'none';
+    jobResults.replaceChildren();
+}
+
+function showError(message) {
+    errorMessage.textContent = message;
+    errorMessage.style.display = 'block';
+}
+
+function hideError() {
+    errorMessage.style.display = 'none';
+}
+
+// Click on upload area to trigger file input
+uploadArea.addEventListener('click', function(e) {
+    if (e.target !== this.querySelector('.browse-btn')) {
+        fileInput.click();
+    }
+});
@@ -0,0 +1,210 @@
+"""Volumetric studies (multi-frame TIFF, .npy/.npz stacks) scored slice-wise in fixed-size batches.
+
+A study is opened as a ``Volume`` with random access to single slices and is
+never materialized as a whole: TIFF frames are decoded one at a time via seek,
+.npy data is viewed in place (uploaded bytes) or memory-mapped (paths), and an
+.npz member is spooled to a temporary file and memory-mapped. Slices are read
+``batch_size`` at a time, windowed to 8-bit, resized and normalized with tensor
+ops on the whole batch, and scored with one forward per batch, so memory stays
+at about one batch regardless of the number of slices.
+"""
+import io
+import os
+import shutil
+import tempfile
+import zipfile
+
+import numpy as np
+import torch
+from PIL import Image
+
+from predict import CLASS_NAMES, predict_probs
+from preprocess import IMAGE_SIZE, MEAN, STD, thread_buffer
+
+VOLUME_EXTENSIONS = {'tif', 'tiff', 'npy', 'npz'}
+VOLUME_BATCH_SIZE = int(os.environ.get("VOLUME_BATCH_SIZE", 32))
+VOLUME_TOP_SLICES = int(os.environ.get("VOLUME_TOP_SLICES", 5))
+# Auto windowing: intensity percentiles estimated from this many evenly spaced slices
+WINDOW_SAMPLE_SLICES = 16
+WINDOW_PERCENTILES = (0.5, 99.5)
+_MEAN = torch.tensor(MEAN).view(1, 3, 1, 1)
+_STD = torch.tensor(STD).view(1, 3, 1, 1)
+
+
+class Volume:
+    """Random access to the 2-D slices of a study, as (H, W) or (H, W, 3) arrays"""
+
+    def __init__(self, array=None, tiff=None, cleanup=None):
+        self._array = array
+        self._tiff = tiff
+        self._cleanup = cleanup
+
+    def __len__(self):
+        return self._tiff.n_frames if self._tiff is not None else len(self._array)
+
+    def slices(self, indices):
+        if self._tiff is None:
+            return [self._array[i] for i in indices]
+        frames = []
+        for i in indices:
+            self._tiff.seek(i)
+            frame = self._tiff if self._tiff.mode in ('L', 'I', 'I;16', 'F', 'RGB') else self._tiff.convert('RGB')
+            frames.append(np.asarray(frame))
+        return frames
+
+    def close(self):
+        if self._tiff is not None:
+            self._tiff.close()
+        self._array = None
+        if self._cleanup is not None:
+            self._cleanup()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _npy_view(buffer):
+    """Zero-copy ndarray over the data of an in-memory .npy file"""
+    stream = io.BytesIO(buffer)
+    version = np.lib.format.read_magic(stream)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(stream)
+    elif version == (2, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(stream)
+    else:
+        raise ValueError(f"Unsupported .npy format version {version}")
+    if fortran_order:
+        raise ValueError("Fortran-ordered .npy volumes are not supported; save with np.save(np.ascontiguousarray(v))")
+    return np.frombuffer(buffer, dtype=dtype, count=int(np.prod(shape)), offset=stream.tell()).reshape(shape)
+
+
+def _spooled_member(archive, name):
+    """Copy one .npz member to a temporary file in chunks and memory-map it"""
+    fd, path = tempfile.mkstemp(suffix='.npy')
+    with os.fdopen(fd, 'wb') as out, archive.open(name) as member:
+        shutil.copyfileobj(member, out, 1 << 20)
+    try:
+        array = np.load(path, mmap_mode='r')
+    except Exception:
+        os.remove(path)
+        raise
+    return array, lambda: os.remove(path)
+
+
+def open_volume(source, filename=None, key=None):
+    """Open a path, bytes or binary stream holding a multi-frame TIFF, .npy or .npz study.
+
+    ``key`` selects the array inside an .npz (default: the first one). Arrays are
+    (slices, H, W) or (slices, H, W, 3).
+    """
+    name = (filename or (source if isinstance(source, str) else "")).lower()
+    ext = name.rsplit('.', 1)[-1] if '.' in name else ''
+    if ext not in VOLUME_EXTENSIONS:
+        raise ValueError(f"Unsupported study format {ext!r}; expected one of {sorted(VOLUME_EXTENSIONS)}")
+    if ext in ('tif', 'tiff'):
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            source = io.BytesIO(source)
+        return Volume(tiff=Image.open(source))
+    if ext == 'npy':
+        if isinstance(source, str):
+            array = np.load(source, mmap_mode='r')
+        else:
+            array = _npy_view(source.getbuffer() if hasattr(source, 'getbuffer') else source)
+    else:
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            source = io.BytesIO(source)
+        with zipfile.ZipFile(source) as archive:
+            members = [n for n in archive.namelist() if n.endswith('.npy')]
+            if not members:
+                raise ValueError("No arrays in .npz study")
+            member = f"{key}.npy" if key is not None else members[0]
+            if member not in members:
+                raise ValueError(f"No array named {key!r} in .npz study")
+            array, cleanup = _spooled_member(archive, member)
+        volume = Volume(array=array, cleanup=cleanup)
+        try:
+            _check_shape(array)
+        except ValueError:
+            volume.close()
+            raise
+        return volume
+    _check_shape(array)
+    return Volume(array=array)
+
+
+def _check_shape(array):
+    if array.ndim not in (3, 4) or (array.ndim == 4 and array.shape[-1] != 3):
+        raise ValueError(f"Expected a (slices, H, W) or (slices, H, W, 3) volume, got shape {array.shape}")
+
+
+def auto_window(volume):
+    """(low, high) intensity window from percentiles of a sample of evenly spaced slices"""
+    n = len(volume)
+    sample = volume.slices(np.unique(np.linspace(0, n - 1, min(n, WINDOW_SAMPLE_SLICES)).astype(int)))
+    if all(s.dtype == np.uint8 for s in sample):
+        return 0.0, 255.0
+    low, high = np.percentile(np.stack(sample).astype(np.float32), WINDOW_PERCENTILES)
+    return float(low), float(max(high, low + 1e-6))
+
+
+def slices_to_batch(slices, window, out, size=IMAGE_SIZE):
+    """Window a list of same-shape slices to 8-bit and write the normalized (N, 3, H, W) batch into ``out``"""
+    low, high = window
+    stack = torch.from_numpy(np.stack(slices).astype(np.float32, copy=False))
+    # Grayscale stays single-channel until the final broadcast against the 3-channel mean/std
+    stack = stack.unsqueeze(1) if stack.dim() == 3 else stack.permute(0, 3, 1, 2)
+    # Window to 0..255 and quantize like an 8-bit image would be before the usual transform
+    pixels = ((stack - low) * (255.0 / (high - low))).clamp_(0, 255).round_()
+    if tuple(pixels.shape[-2:]) != tuple(size):
+        pixels = torch.nn.functional.interpolate(pixels, size=size, mode='bilinear', align_corners=False,
+                                                 antialias=True)
+    torch.sub(pixels.div_(255.0), _MEAN, out=out)
+    return out.div_(_STD)
+
+
+def score_volume(volume, model, batch_size=VOLUME_BATCH_SIZE, window=None, aggregate="topk",
+                 top_slices=VOLUME_TOP_SLICES):
+    """Score every slice in fixed-size batches and aggregate to one study-level prediction.
+
+    Slices are ranked by their most likely tumor class (1 - p(no_tumor)).
+    ``aggregate`` is "mean" (all slices), "max" (per-class max, renormalized) or
+    "topk" (mean over the ``top_slices`` highest-ranked slices).
+    """
+    n = len(volume)
+    if n == 0:
+        raise ValueError("Study has no slices")
+    if window is None:
+        window = auto_window(volume)
+    buffer = thread_buffer(batch_size)
+    probs = np.empty((n, len(CLASS_NAMES)), dtype=np.float32)
+    for start in range(0, n, batch_size):
+        indices = range(start, min(start + batch_size, n))
+        batch = slices_to_batch(volume.slices(indices), window, buffer.view(len(indices)))
+        probs[start:start + len(indices)] = predict_probs(batch, model).cpu().numpy()
+    no_tumor = CLASS_NAMES.index("no_tumor") if "no_tumor" in CLASS_NAMES else None
+    suspicion = 1.0 - probs[:, no_tumor] if no_tumor is not None else probs.max(axis=1)
+    ranked = np.argsort(-suspicion, kind="stable")
+    if aggregate == "mean":
+        study = probs.mean(axis=0)
+    elif aggregate == "max":
+        study = probs.max(axis=0)
+        study = study / study.sum()
+    elif aggregate == "topk":
+        study = probs[ranked[:max(1, top_slices)]].mean(axis=0)
+    else:
+        raise ValueError(f"Unknown aggregation {aggregate!r}")
+    best = int(study.argmax())
+    return {
+        "prediction": CLASS_NAMES[best],
+        "confidence": float(study[best]),
+        "probabilities": {name: float(p) for name, p in zip(CLASS_NAMES, study)},
+        "aggregation": aggregate,
+        "slices": n,
+        "window": [window[0], window[1]],
+        "top_slices": [{"index": int(i), "prediction": CLASS_NAMES[int(probs[i].argmax())],
+                        "confidence": float(probs[i].max()), "suspicion": float(suspicion[i])}
+                       for i in ranked[:top_slices]],
+    }
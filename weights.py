@@ -0,0 +1,117 @@
+"""Checkpoint conversion and zero-copy weight loading for fast cold starts.
+
+The training checkpoint is a full pickle (optionally wrapped in
+``model_state_dict`` and with ``module.`` prefixes from DataParallel). On first
+load it is rewritten once as a flat, clean state dict next to the ``.pth``:
+``.safetensors`` when the safetensors package is installed, otherwise a
+``.weights.pt`` torch zip archive. Both are memory-mapped on later loads, so
+start-up reads only the pages that are touched and forked workers share them
+through the page cache.
+
+Every derived artifact records the checkpoint it was built from (stamp and
+content hash: in the safetensors metadata, else a ``<artifact>.source``
+sidecar), so replacing the checkpoint invalidates it whatever the mtimes say.
+"""
+import json
+import os
+
+import torch
+
+from cache import file_stamp, fingerprint_file
+
+try:
+    from safetensors import safe_open as _safe_open
+    from safetensors.torch import load_file as _load_safetensors, save_file as _save_safetensors
+except ImportError:
+    _safe_open = _load_safetensors = _save_safetensors = None
+
+
+def artifact_path(checkpoint_path, suffix):
+    """Derived artifacts live next to the checkpoint: model.pth -> model<suffix>"""
+    return os.path.splitext(checkpoint_path)[0] + suffix
+
+
+def source_record(checkpoint_path):
+    return {"source_stamp": file_stamp(checkpoint_path), "source_sha256": fingerprint_file(checkpoint_path)}
+
+
+def _recorded_source(artifact):
+    try:
+        if artifact.endswith('.safetensors'):
+            with _safe_open(artifact, 'pt') as f:
+                return f.metadata() or {}
+        with open(artifact + '.source', 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+
+def mark_fresh(artifact, checkpoint_path):
+    """Record ``checkpoint_path`` as the source of a just-written artifact (non-safetensors)"""
+    with open(artifact + '.source', 'w', encoding='utf-8') as f:
+        json.dump(source_record(checkpoint_path), f)
+
+
+def is_fresh(artifact, checkpoint_path):
+    """Whether ``artifact`` was built from the current contents of ``checkpoint_path``.
+
+    A matching stamp is enough; otherwise (touched, or replaced by a copy) the content hash decides.
+    """
+    if not os.path.exists(artifact):
+        return False
+    recorded = _recorded_source(artifact)
+    if not recorded.get("source_sha256"):
+        return False
+    if recorded.get("source_stamp") == file_stamp(checkpoint_path):
+        return True
+    return recorded["source_sha256"] == fingerprint_file(checkpoint_path)
+
+
+def converted_path(checkpoint_path):
+    return artifact_path(checkpoint_path, '.safetensors' if _save_safetensors else '.weights.pt')
+
+
+def read_checkpoint(checkpoint_path, map_location='cpu'):
+    """State dict from the original training checkpoint, with ``module.`` prefixes removed"""
+    state = torch.load(checkpoint_path, map_location=map_location)
+    state_dict = state.get("model_state_dict", state) if isinstance(state, dict) else state
+    return {k[len("module."):] if k.startswith("module.") else k: v for k, v in state_dict.items()}
+
+
+def convert_checkpoint(checkpoint_path, force=False):
+    """Write the memory-mappable copy of ``checkpoint_path`` unless a fresh one exists"""
+    path = converted_path(checkpoint_path)
+    if force or not is_fresh(path, checkpoint_path):
+        source = source_record(checkpoint_path)
+        state_dict = {k: v.detach().cpu().contiguous() for k, v in read_checkpoint(checkpoint_path).items()}
+        tmp_path = path + '.tmp'
+        if _save_safetensors:
+            _save_safetensors(state_dict, tmp_path, metadata=source)
+            os.replace(tmp_path, path)
+        else:
+            torch.save(state_dict, tmp_path)
+            os.replace(tmp_path, path)
+            with open(path + '.source', 'w', encoding='utf-8') as f:
+                json.dump(source, f)
+    return path
+
+
+def load_state_dict(checkpoint_path, convert=True):
+    """Memory-mapped state dict for ``checkpoint_path``, converting it on first use.
+
+    Falls back to reading the original checkpoint when the converted copy cannot be
+    written (e.g. a read-only model directory).
+    """
+    if convert:
+        try:
+            path = convert_checkpoint(checkpoint_path)
+        except OSError as e:
+            print(f"Could not write converted weights next to {checkpoint_path}: {e}")
+            return read_checkpoint(checkpoint_path)
+    else:
+        path = converted_path(checkpoint_path)
+        if not is_fresh(path, checkpoint_path):
+            return read_checkpoint(checkpoint_path)
+    if path.endswith('.safetensors'):
+        return _load_safetensors(path)
+    return torch.load(path, mmap=True, weights_only=True)